@@ -0,0 +1,258 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from starlette.responses import JSONResponse
+from app.metrics import ADMISSION_REJECTED
+from app.routers.chat import get_current_user
+from dotenv import load_dotenv
+load_dotenv()
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "local")
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "2"))
+ADMISSION_MAX_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", "100000"))
+
+
+class LimiterBackend:
+    """Per-key token buckets. ``take`` returns 0 when a token was taken,
+    otherwise the seconds until one will be available."""
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        raise NotImplementedError
+
+    async def start(self, db):
+        pass
+
+
+class LocalLimiterBackend(LimiterBackend):
+    """Buckets in process memory; each node enforces the limits on its own."""
+
+    def __init__(self, max_keys: int = ADMISSION_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (float(burst), now))
+        tokens = min(float(burst), tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class MongoLimiterBackend(LimiterBackend):
+    """Buckets in the rate_limits collection, shared by every API node.
+
+    Each take is a single atomic pipeline update that refills the bucket
+    using the server clock ($$NOW), so nodes need not agree on time.
+    Idle buckets expire through a TTL index.
+    """
+
+    def __init__(self, idle_ttl_seconds: int = 3600):
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._db = None
+
+    async def start(self, db):
+        self._db = db
+        await db.rate_limits.create_index("updated", expireAfterSeconds=self.idle_ttl_seconds)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated", "$$NOW"]}]}, 1000]}
+        refilled = {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, rate]}]}]}
+        doc = await self._db.rate_limits.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated": "$$NOW"}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return 0.0 if doc["allowed"] else (1 - doc["tokens"]) / rate
+
+
+BACKENDS = {
+    "local": LocalLimiterBackend,
+    "mongo": MongoLimiterBackend,
+}
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ConcurrencyLimiter:
+    """Caps in-flight requests, with a bounded, time-limited wait queue."""
+
+    def __init__(self, limit: int, queue_size: int, timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+
+    async def acquire(self):
+        if not self._semaphore.locked():
+            # A free slot is taken without suspending, so concurrent arrivals
+            # see an accurate count before any of them queues.
+            await self._semaphore.acquire()
+            self.active += 1
+            return
+        if self.waiting >= self.queue_size:
+            raise Overloaded("queue_full")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded("queue_timeout")
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+
+class RouteClass:
+    """A group of expensive routes sharing one concurrency cap and per-user rate.
+
+    Limits come from ADMISSION_<NAME>_CONCURRENCY, _QUEUE, _USER_RATE (per
+    second, 0 disables) and _USER_BURST.
+    """
+
+    def __init__(self, name: str, method: str, prefixes: tuple, concurrency: int, queue: int, rate: float, burst: int, by_user: bool = True):
+        env = f"ADMISSION_{name.upper()}"
+        self.name = name
+        self.method = method
+        self.prefixes = prefixes
+        self.rate = float(os.getenv(f"{env}_USER_RATE", str(rate)))
+        self.burst = int(os.getenv(f"{env}_USER_BURST", str(burst)))
+        self.by_user = by_user
+        self.limiter = ConcurrencyLimiter(
+            int(os.getenv(f"{env}_CONCURRENCY", str(concurrency))), int(os.getenv(f"{env}_QUEUE", str(queue)))
+        )
+        self.rate_limited = 0
+        self.shed = 0
+
+    def matches(self, method: str, path: str) -> bool:
+        return method == self.method and any(path == p or path.startswith(p + "/") for p in self.prefixes)
+
+    def stats(self):
+        return {
+            "active": self.limiter.active,
+            "waiting": self.limiter.waiting,
+            "concurrency": self.limiter.limit,
+            "queue_size": self.limiter.queue_size,
+            "user_rate": self.rate,
+            "user_burst": self.burst,
+            "rate_limited": self.rate_limited,
+            "shed": self.shed,
+        }
+
+
+ROUTE_CLASSES = [
+    RouteClass("llm", "POST", ("/chats/summarize", "/chats/insights"), concurrency=32, queue=64, rate=1, burst=10),
+    # Login and registration run bcrypt; there is no token yet, so limit per client address.
+    RouteClass("auth", "POST", ("/users/auth/login", "/users/auth/register"), concurrency=8, queue=32, rate=2, burst=10, by_user=False),
+    RouteClass("export", "GET", ("/exports",), concurrency=4, queue=8, rate=0.2, burst=5),
+]
+
+
+def _client_key(scope) -> str:
+    client = scope.get("client")
+    return f"ip:{client[0]}" if client else "ip:unknown"
+
+
+def _user_key(scope) -> str:
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                try:
+                    return f"user:{get_current_user(token)}"
+                except HTTPException:
+                    break
+    return _client_key(scope)
+
+
+def _reject(status: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        {"detail": detail}, status_code=status, headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+class AdmissionMiddleware:
+    """Per-user rate limits and per-route-class concurrency caps.
+
+    Requests over a user's rate get 429; requests that find the route class
+    saturated wait in a bounded queue and get 503 when it is full or the
+    wait times out. Both carry Retry-After. The slot is held until the
+    response body finishes, so streamed responses count while they run.
+    Plain ASGI rather than BaseHTTPMiddleware for exactly that reason.
+    """
+
+    def __init__(self, app, route_classes: list = ROUTE_CLASSES):
+        self.app = app
+        self.route_classes = route_classes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_ENABLED:
+            return await self.app(scope, receive, send)
+        route_class = next((rc for rc in self.route_classes if rc.matches(scope["method"], scope["path"])), None)
+        if route_class is None:
+            return await self.app(scope, receive, send)
+        if route_class.rate > 0:
+            key = f"{route_class.name}:{_user_key(scope) if route_class.by_user else _client_key(scope)}"
+            wait = await admission.backend.take(key, route_class.rate, route_class.burst)
+            if wait > 0:
+                route_class.rate_limited += 1
+                ADMISSION_REJECTED.labels(route_class.name, "rate_limited").inc()
+                return await _reject(429, "Rate limit exceeded", wait)(scope, receive, send)
+        try:
+            await route_class.limiter.acquire()
+        except Overloaded as e:
+            route_class.shed += 1
+            ADMISSION_REJECTED.labels(route_class.name, str(e)).inc()
+            return await _reject(503, "Server busy", ADMISSION_RETRY_AFTER_SECONDS)(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.limiter.release()
+
+
+class Admission:
+    """Holds the configured limiter backend and exposes stats."""
+
+    def __init__(self, backend_name: str = ADMISSION_BACKEND):
+        if backend_name not in BACKENDS:
+            raise ValueError(f"Unknown ADMISSION_BACKEND: {backend_name}")
+        self.backend_name = backend_name
+        self.backend = BACKENDS[backend_name]()
+
+    async def start(self, db):
+        await self.backend.start(db)
+
+    def stats(self):
+        return {
+            "enabled": ADMISSION_ENABLED,
+            "backend": self.backend_name,
+            "route_classes": {rc.name: rc.stats() for rc in ROUTE_CLASSES},
+        }
+
+
+admission = Admission()
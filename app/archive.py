@@ -0,0 +1,378 @@
+import asyncio
+import gzip
+import heapq
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional, List
+from urllib.parse import quote
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from app.serialization import dumps
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+# Only the holder of the archive lease moves messages; it is renewed per batch.
+ARCHIVE_LEASE_SECONDS = float(os.getenv("ARCHIVE_LEASE_SECONDS", "600"))
+
+
+def retention_cutoff() -> Optional[datetime]:
+    """Messages strictly older than this belong in cold storage; None when retention is off."""
+    if RETENTION_DAYS <= 0:
+        return None
+    return datetime.utcnow() - timedelta(days=RETENTION_DAYS)
+
+
+def _segment_path(user_id: str, month: str) -> str:
+    # Quote the user id so it cannot escape the archive directory.
+    user_dir = quote(user_id, safe="").replace(".", "%2E")
+    return os.path.join(user_dir, month, f"{uuid.uuid4().hex}.ndjson.gz")
+
+
+def _encode(doc: dict) -> bytes:
+    return dumps({
+        "_id": str(doc["_id"]),
+        "conversation_id": doc["conversation_id"],
+        "user_id": doc["user_id"],
+        "message": doc["message"],
+        "timestamp": doc["timestamp"].isoformat(),
+    }) + b"\n"
+
+
+def _decode(line: bytes) -> dict:
+    doc = json.loads(line)
+    if ObjectId.is_valid(doc["_id"]):
+        doc["_id"] = ObjectId(doc["_id"])
+    doc["timestamp"] = datetime.fromisoformat(doc["timestamp"])
+    return doc
+
+
+def write_segment(relative_path: str, docs: List[dict]):
+    path = os.path.join(ARCHIVE_DIR, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with gzip.open(tmp, "wb") as f:
+        f.writelines(_encode(doc) for doc in docs)
+    os.replace(tmp, path)
+
+
+def read_segment(relative_path: str) -> List[dict]:
+    with gzip.open(os.path.join(ARCHIVE_DIR, relative_path), "rb") as f:
+        return [_decode(line) for line in f if line.strip()]
+
+
+def _matches(doc: dict, conversation_id: str, start_date, end_date, keywords) -> bool:
+    if doc["conversation_id"] != conversation_id:
+        return False
+    if start_date and doc["timestamp"] < start_date:
+        return False
+    if end_date and doc["timestamp"] > end_date:
+        return False
+    if keywords:
+        # Approximates $text for cold data: any keyword, case-insensitive.
+        text = doc["message"].lower()
+        return any(k.lower() in text for k in keywords)
+    return True
+
+
+def _read_matching(paths: List[str], conversation_id: str, start_date, end_date, keywords) -> List[dict]:
+    docs = {}
+    for path in paths:
+        try:
+            segment = read_segment(path)
+        except FileNotFoundError:
+            logger.warning("Archive segment %s is missing", path)
+            continue
+        for doc in segment:
+            # An interrupted run can archive a message twice; keep one copy.
+            if _matches(doc, conversation_id, start_date, end_date, keywords):
+                docs[doc["_id"]] = doc
+    return sorted(docs.values(), key=lambda doc: (doc["timestamp"], doc["_id"]))
+
+
+async def read_archived(conversation_id: str, db, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, keywords: Optional[List[str]] = None) -> List[dict]:
+    """Archived messages of a conversation in the date range, oldest first.
+
+    Decided from the catalog alone, not the current RETENTION_DAYS, so
+    messages archived before retention was lowered or turned off stay
+    visible. The indexed catalog lookup is the only cost when none match.
+    """
+    query = {"conversation_ids": conversation_id}
+    if start_date:
+        query["last_timestamp"] = {"$gte": start_date}
+    if end_date:
+        query["first_timestamp"] = {"$lte": end_date}
+    paths = [segment["_id"] async for segment in db.archive_segments.find(query, {"_id": 1})]
+    if not paths:
+        return []
+    return await asyncio.to_thread(_read_matching, paths, conversation_id, start_date, end_date, keywords)
+
+
+def _read_export(paths: List[str], conversation_id, user_id, start_date, end_date, after) -> List[dict]:
+    docs = {}
+    for path in paths:
+        try:
+            segment = read_segment(path)
+        except FileNotFoundError:
+            logger.warning("Archive segment %s is missing", path)
+            continue
+        for doc in segment:
+            if conversation_id is not None and doc["conversation_id"] != conversation_id:
+                continue
+            if user_id is not None and doc["user_id"] != user_id:
+                continue
+            if (start_date and doc["timestamp"] < start_date) or (end_date and doc["timestamp"] > end_date):
+                continue
+            if after is not None and (doc["timestamp"], doc["_id"]) <= after:
+                continue
+            docs[doc["_id"]] = doc
+    return sorted(docs.values(), key=lambda doc: (doc["timestamp"], doc["_id"]))
+
+
+async def iter_archived(db, conversation_id: Optional[str] = None, user_id: Optional[str] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, after: Optional[tuple] = None) -> AsyncIterator[dict]:
+    """Archived messages matching the filters in (timestamp, _id) order, for exports.
+
+    Segments never span a calendar month, so they are read one month at a
+    time and memory stays bounded by a month of matching messages.
+    ``after`` is a (timestamp, _id) position to resume from.
+    """
+    query = {}
+    if conversation_id is not None:
+        query["conversation_ids"] = conversation_id
+    if user_id is not None:
+        query["user_id"] = user_id
+    lower = start_date
+    if after is not None:
+        lower = max(lower, after[0]) if lower else after[0]
+    if lower:
+        query["last_timestamp"] = {"$gte": lower}
+    if end_date:
+        query["first_timestamp"] = {"$lte": end_date}
+    months = {}
+    async for segment in db.archive_segments.find(query, {"_id": 1, "month": 1}):
+        months.setdefault(segment["month"], []).append(segment["_id"])
+    for month in sorted(months):
+        docs = await asyncio.to_thread(_read_export, months[month], conversation_id, user_id, start_date, end_date, after)
+        for doc in docs:
+            yield doc
+
+
+def merge_archived(archived: List[dict], hot: List[dict]) -> List[dict]:
+    """Merge two (timestamp, _id)-sorted lists, preferring the hot copy of any duplicate."""
+    hot_ids = {doc["_id"] for doc in hot}
+    archived = [doc for doc in archived if doc["_id"] not in hot_ids]
+    return list(heapq.merge(archived, hot, key=lambda doc: (doc["timestamp"], doc["_id"])))
+
+
+def apply_projection(doc: dict, projection: Optional[dict]) -> dict:
+    """Apply an inclusion projection such as MESSAGE_PROJECTION to an archived document."""
+    if not projection:
+        return doc
+    keep = {field for field, include in projection.items() if include and field != "_id"}
+    out = {field: value for field, value in doc.items() if field in keep}
+    if projection.get("_id", 1):
+        out["_id"] = doc["_id"]
+    return out
+
+
+def _conversation_counts(docs: List[dict]) -> List[dict]:
+    """Per-conversation message counts and time spans of a segment, for rebuilding the conversations view."""
+    counts = {}
+    for doc in docs:
+        entry = counts.setdefault(doc["conversation_id"], {
+            "conversation_id": doc["conversation_id"],
+            "count": 0,
+            "first_timestamp": doc["timestamp"],
+            "last_timestamp": doc["timestamp"],
+        })
+        entry["count"] += 1
+        entry["first_timestamp"] = min(entry["first_timestamp"], doc["timestamp"])
+        entry["last_timestamp"] = max(entry["last_timestamp"], doc["timestamp"])
+    return [counts[cid] for cid in sorted(counts)]
+
+
+async def archive_batch(db, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move up to ``batch_size`` of the oldest expired messages into segment files.
+
+    Segments are grouped per user and month. The catalog entry is written
+    before the hot copies are deleted, so a crash in between leaves
+    duplicates, which reads drop by _id, rather than losing messages.
+    """
+    cursor = db.chat_messages.find({"timestamp": {"$lt": cutoff}}).sort([("timestamp", 1)]).limit(batch_size)
+    docs = await cursor.to_list(length=None)
+    if not docs:
+        return 0
+    groups = {}
+    for doc in docs:
+        groups.setdefault((doc["user_id"], doc["timestamp"].strftime("%Y-%m")), []).append(doc)
+    for (user_id, month), group in groups.items():
+        relative_path = _segment_path(user_id, month)
+        await asyncio.to_thread(write_segment, relative_path, group)
+        await db.archive_segments.insert_one({
+            "_id": relative_path,
+            "user_id": user_id,
+            "month": month,
+            "conversation_ids": sorted({doc["conversation_id"] for doc in group}),
+            "conversations": _conversation_counts(group),
+            "first_timestamp": group[0]["timestamp"],
+            "last_timestamp": group[-1]["timestamp"],
+            "count": len(group),
+            "created_at": datetime.utcnow(),
+        })
+    await db.chat_messages.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+    return len(docs)
+
+
+async def acquire_lease(db, name: str, owner: str, seconds: float) -> bool:
+    """Take or renew a named lease in the leases collection; False if another owner holds it."""
+    now = datetime.utcnow()
+    try:
+        doc = await db.leases.find_one_and_update(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lte": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # The upsert raced with a live holder's document.
+        return False
+    return doc is not None
+
+
+async def release_lease(db, name: str, owner: str):
+    await db.leases.delete_one({"_id": name, "owner": owner})
+
+
+async def archive_expired(db, batch_size: int = ARCHIVE_BATCH_SIZE) -> Optional[int]:
+    """Archive everything past the cutoff; None if another process holds the archive lease.
+
+    Without the lease, workers and nodes would archive the same batch
+    concurrently and the segment counts would include it twice.
+    """
+    cutoff = retention_cutoff()
+    if cutoff is None:
+        return 0
+    owner = uuid.uuid4().hex
+    total = 0
+    try:
+        while True:
+            if not await acquire_lease(db, "archive", owner, ARCHIVE_LEASE_SECONDS):
+                return total or None
+            moved = await archive_batch(db, cutoff, batch_size)
+            total += moved
+            if moved < batch_size:
+                return total
+    finally:
+        await release_lease(db, "archive", owner)
+
+
+def _rewrite_without(relative_path: str, conversation_id: str) -> tuple[int, Optional[datetime], Optional[datetime]]:
+    docs = [doc for doc in read_segment(relative_path) if doc["conversation_id"] != conversation_id]
+    if not docs:
+        os.remove(os.path.join(ARCHIVE_DIR, relative_path))
+        return 0, None, None
+    write_segment(relative_path, docs)
+    return len(docs), docs[0]["timestamp"], docs[-1]["timestamp"]
+
+
+async def purge_archived_conversation(conversation_id: str, db) -> int:
+    """Remove a conversation from every segment that holds it; returns segments touched."""
+    touched = 0
+    async for segment in db.archive_segments.find({"conversation_ids": conversation_id}):
+        try:
+            count, first, last = await asyncio.to_thread(_rewrite_without, segment["_id"], conversation_id)
+        except FileNotFoundError:
+            count = 0
+        if count == 0:
+            await db.archive_segments.delete_one({"_id": segment["_id"]})
+        else:
+            await db.archive_segments.update_one(
+                {"_id": segment["_id"]},
+                {
+                    "$pull": {"conversation_ids": conversation_id, "conversations": {"conversation_id": conversation_id}},
+                    "$set": {"count": count, "first_timestamp": first, "last_timestamp": last},
+                },
+            )
+        touched += 1
+    return touched
+
+
+async def backfill_conversation_counts(db) -> int:
+    """Add per-conversation counts to segments archived before they were recorded."""
+    filled = 0
+    async for segment in db.archive_segments.find({"conversations": {"$exists": False}}, {"_id": 1}):
+        try:
+            docs = await asyncio.to_thread(read_segment, segment["_id"])
+        except FileNotFoundError:
+            logger.warning("Archive segment %s is missing", segment["_id"])
+            continue
+        await db.archive_segments.update_one({"_id": segment["_id"]}, {"$set": {"conversations": _conversation_counts(docs)}})
+        filled += 1
+    return filled
+
+
+class Archiver:
+    """Periodically moves messages past RETENTION_DAYS into cold storage.
+
+    Every process runs one, but only the holder of the archive lease does
+    the work; the others count the run as skipped.
+    """
+
+    def __init__(self, interval: float = ARCHIVE_INTERVAL_SECONDS, batch_size: int = ARCHIVE_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.archived = 0
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_run: Optional[datetime] = None
+
+    def start(self, db):
+        if RETENTION_DAYS <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(db))
+
+    async def _run(self, db):
+        while True:
+            try:
+                moved = await archive_expired(db, self.batch_size)
+                if moved is None:
+                    self.skipped += 1
+                else:
+                    self.archived += moved
+                    self.runs += 1
+            except (PyMongoError, OSError) as e:
+                self.failures += 1
+                logger.warning("Archive run failed: %s", e)
+            self.last_run = datetime.utcnow()
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self):
+        return {
+            "retention_days": RETENTION_DAYS,
+            "running": self._task is not None,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "archived": self.archived,
+            "failures": self.failures,
+            "last_run": self.last_run,
+        }
+
+
+archiver = Archiver()
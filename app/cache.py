@@ -0,0 +1,107 @@
+import hashlib
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+from dotenv import load_dotenv
+load_dotenv()
+
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "0"))
+
+
+def messages_digest(messages: list[dict]) -> str:
+    """Stable hash of a conversation's message set."""
+    h = hashlib.sha256()
+    for msg in messages:
+        timestamp = msg.get("timestamp")
+        h.update(str(msg.get("user_id", "")).encode())
+        h.update(b"\x1f")
+        h.update(str(msg.get("message", "")).encode())
+        h.update(b"\x1f")
+        h.update((timestamp.isoformat() if isinstance(timestamp, datetime) else str(timestamp)).encode())
+        h.update(b"\x1e")
+    return h.hexdigest()
+
+
+def cache_key(conversation_id: str, digest: str, kind: str, model: str) -> str:
+    return hashlib.sha256("\x1f".join((conversation_id, digest, kind, model)).encode()).hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache for LLM results: in-process LRU backed by the llm_cache collection."""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[str, str]]" = OrderedDict()
+        self._by_conversation: dict[str, set] = {}
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _remember(self, key: str, conversation_id: str, value: str):
+        self._entries[key] = (conversation_id, value)
+        self._entries.move_to_end(key)
+        self._by_conversation.setdefault(conversation_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            old_key, (old_conversation, _) = self._entries.popitem(last=False)
+            keys = self._by_conversation.get(old_conversation)
+            if keys is not None:
+                keys.discard(old_key)
+                if not keys:
+                    del self._by_conversation[old_conversation]
+
+    async def get(self, db, conversation_id: str, digest: str, kind: str, model: str) -> Optional[str]:
+        key = cache_key(conversation_id, digest, kind, model)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return entry[1]
+        doc = await db.llm_cache.find_one({"_id": key}, {"value": 1})
+        if doc is not None:
+            self.persistent_hits += 1
+            self._remember(key, conversation_id, doc["value"])
+            return doc["value"]
+        self.misses += 1
+        return None
+
+    async def set(self, db, conversation_id: str, digest: str, kind: str, model: str, value: str):
+        key = cache_key(conversation_id, digest, kind, model)
+        self._remember(key, conversation_id, value)
+        await db.llm_cache.replace_one(
+            {"_id": key},
+            {
+                "_id": key,
+                "conversation_id": conversation_id,
+                "digest": digest,
+                "kind": kind,
+                "model": model,
+                "value": value,
+                "created_at": datetime.utcnow(),
+            },
+            upsert=True,
+        )
+
+    async def invalidate(self, db, conversation_id: str):
+        for key in self._by_conversation.pop(conversation_id, ()):
+            self._entries.pop(key, None)
+        await db.llm_cache.delete_many({"conversation_id": conversation_id})
+        self.invalidations += 1
+
+    def stats(self):
+        lookups = self.memory_hits + self.persistent_hits + self.misses
+        hits = self.memory_hits + self.persistent_hits
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "memory_hits": self.memory_hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+result_cache = ResultCache()
@@ -1,19 +1,51 @@
 from app.models import ChatMessage, User
-from datetime import datetime
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import heapq
+import logging
+import os
 from typing import Optional, List
 from passlib.context import CryptContext
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from app.cache import result_cache, LLM_CACHE_TTL_SECONDS
+from app.realtime import conversation_hub
+from app.archive import (
+    read_archived, merge_archived, apply_projection, purge_archived_conversation, backfill_conversation_counts,
+    iter_archived,
+)
+from app.similarity import similarity_index
+
+logger = logging.getLogger(__name__)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt is CPU-bound; run it on a dedicated bounded pool so it neither blocks
+# the event loop nor competes with the default executor.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+CHAT_DELETE_BATCH_SIZE = int(os.getenv("CHAT_DELETE_BATCH_SIZE", "1000"))
+
 def get_password_hash(password):
     return pwd_context.hash(password)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
+async def get_password_hash_async(password):
+    return await asyncio.get_running_loop().run_in_executor(_password_executor, get_password_hash, password)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await asyncio.get_running_loop().run_in_executor(
+        _password_executor, verify_password, plain_password, hashed_password
+    )
+
 async def create_user(user, db):
     user_dict = user.dict()
-    user_dict["hashed_password"] = get_password_hash(user_dict.pop("password"))
+    user_dict["hashed_password"] = await get_password_hash_async(user_dict.pop("password"))
     await db.users.insert_one(user_dict)
     return user_dict
 
@@ -21,18 +53,136 @@ async def get_user_by_username(username, db):
     return await db.users.find_one({"username": username})
 
 async def ensure_indexes(db):
-    await db.chat_messages.create_index("conversation_id")
-    await db.chat_messages.create_index("user_id")
-    await db.chat_messages.create_index("timestamp")
+    # Compound indexes back the seek-style queries; their prefixes also serve
+    # plain user_id / conversation_id lookups.
+    await db.chat_messages.create_index([("user_id", 1), ("timestamp", 1), ("_id", 1)])
+    await db.chat_messages.create_index([("conversation_id", 1), ("timestamp", 1), ("_id", 1)])
+    # (timestamp, _id) serves time-range scans and gives date-range exports
+    # a stable keyset order without an in-memory sort.
+    await db.chat_messages.create_index([("timestamp", 1), ("_id", 1)])
+    # The text index is prefixed by user_id, so a $text query with a user_id
+    # equality only reads that user's postings instead of the whole
+    # collection's. A collection may hold one text index; replace the old
+    # unscoped one.
+    if "message_text" in await db.chat_messages.index_information():
+        await db.chat_messages.drop_index("message_text")
+    await db.chat_messages.create_index(
+        [("user_id", 1), ("message", "text")], name="user_message_text", language_override="search_language"
+    )
     await db.users.create_index("username", unique=True)
+    await db.llm_cache.create_index("conversation_id")
+    await db.jobs.create_index([("status", 1), ("priority", 1), ("created_at", 1)])
+    await db.conversations.create_index([("participants", 1), ("last_activity", -1)])
+    await db.archive_segments.create_index([("conversation_ids", 1), ("first_timestamp", 1)])
+    await db.archive_segments.create_index([("user_id", 1), ("first_timestamp", 1)])
+    await db.archive_segments.create_index("first_timestamp")
+    if LLM_CACHE_TTL_SECONDS > 0:
+        await db.llm_cache.create_index("created_at", expireAfterSeconds=LLM_CACHE_TTL_SECONDS)
 
-async def insert_chat_message(chat: ChatMessage, db):
+def _clean_search_term(term: str) -> str:
+    # Quotes and leading dashes are $text operators; keep user input literal.
+    return term.replace('"', " ").strip().lstrip("-").strip()
+
+def build_text_search(keywords: Optional[List[str]] = None, phrases: Optional[List[str]] = None) -> str:
+    """Build a $text search string matching any keyword and every phrase."""
+    parts = [_clean_search_term(k) for k in keywords or []]
+    parts += [f'"{_clean_search_term(p)}"' for p in phrases or []]
+    return " ".join(p for p in parts if p and p != '""')
+
+MESSAGE_PROJECTION = {"_id": 0, "conversation_id": 1, "user_id": 1, "message": 1, "timestamp": 1}
+
+def normalize_timestamp(value) -> datetime:
+    """Coerce a timestamp to a naive UTC datetime, the only form stored."""
+    if value is None:
+        value = datetime.utcnow()
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    # BSON dates hold milliseconds; truncate up front so in-memory copies
+    # (e.g. realtime events and their cursors) match what is stored.
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+def prepare_chat_document(chat: ChatMessage) -> dict:
     data = chat.dict()
-    if 'timestamp' not in data or data['timestamp'] is None:
-        data['timestamp'] = datetime.utcnow()
+    # Unless the caller set one, the timestamp is assigned at insert time, so
+    # rows that wait in a bulk upload or the write-behind queue still sort
+    # after everything already stored.
+    timestamp = chat.dict(exclude_unset=True).get('timestamp')
+    data['timestamp'] = normalize_timestamp(timestamp) if timestamp is not None else None
+    return data
+
+def _stamp(documents: List[dict]):
+    now = normalize_timestamp(None)
+    for doc in documents:
+        if doc.get('timestamp') is None:
+            doc['timestamp'] = now
+
+def _conversation_update(conversation_id: str, count: int, first: datetime, last: datetime, user_ids) -> UpdateOne:
+    return UpdateOne(
+        {"_id": conversation_id},
+        {
+            "$inc": {"message_count": count},
+            "$min": {"first_activity": first},
+            "$max": {"last_activity": last},
+            "$addToSet": {"participants": {"$each": sorted(user_ids)}},
+        },
+        upsert=True,
+    )
+
+async def update_conversation_aggregates(documents: List[dict], db):
+    """Fold newly inserted messages into the materialized conversations view."""
+    groups = {}
+    for doc in documents:
+        group = groups.setdefault(doc["conversation_id"], [0, doc["timestamp"], doc["timestamp"], set()])
+        group[0] += 1
+        group[1] = min(group[1], doc["timestamp"])
+        group[2] = max(group[2], doc["timestamp"])
+        group[3].add(doc["user_id"])
+    if groups:
+        await db.conversations.bulk_write(
+            [_conversation_update(cid, *group) for cid, group in groups.items()], ordered=False
+        )
+
+async def insert_chat_message(chat: ChatMessage, db):
+    data = prepare_chat_document(chat)
+    _stamp([data])
     await db.chat_messages.insert_one(data)
+    conversation_hub.publish_local([data])
+    similarity_index.observe([data])
+    await update_conversation_aggregates([data], db)
+    await result_cache.invalidate(db, data["conversation_id"])
+
+async def insert_chat_documents(documents: List[dict], db) -> List[dict]:
+    """Insert prepared documents with one unordered insert_many.
+
+    Returns a list of {"index", "error"} entries for the rows that failed;
+    indexes are relative to ``documents``.
+    """
+    if not documents:
+        return []
+    failures = []
+    _stamp(documents)
+    try:
+        await db.chat_messages.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        failures = [
+            {"index": err["index"], "error": err.get("errmsg", "write error")}
+            for err in e.details.get("writeErrors", [])
+        ]
+    failed = {failure["index"] for failure in failures}
+    inserted = [doc for i, doc in enumerate(documents) if i not in failed]
+    conversation_hub.publish_local(inserted)
+    similarity_index.observe(inserted)
+    await update_conversation_aggregates(inserted, db)
+    for conversation_id in {doc["conversation_id"] for doc in documents}:
+        await result_cache.invalidate(db, conversation_id)
+    return failures
 
-async def get_chat_messages(conversation_id: str, db, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, keywords: Optional[List[str]] = None):
+async def insert_chat_messages(chats: List[ChatMessage], db) -> List[dict]:
+    return await insert_chat_documents([prepare_chat_document(chat) for chat in chats], db)
+
+def _conversation_query(conversation_id: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, keywords: Optional[List[str]] = None) -> dict:
     query = {"conversation_id": conversation_id}
     if start_date or end_date:
         query["timestamp"] = {}
@@ -43,14 +193,196 @@ async def get_chat_messages(conversation_id: str, db, start_date: Optional[datet
         if not query["timestamp"]:
             del query["timestamp"]
     if keywords:
-        query["message"] = {"$regex": "|".join(keywords), "$options": "i"}
-    cursor = db.chat_messages.find(query)
+        query["$text"] = {"$search": build_text_search(keywords)}
+    return query
+
+async def _conversation_participants(conversation_id: str, db) -> List[str]:
+    doc = await db.conversations.find_one({"_id": conversation_id}, {"participants": 1})
+    if doc is not None:
+        return doc.get("participants", [])
+    return await db.chat_messages.distinct("user_id", {"conversation_id": conversation_id})
+
+async def _find_conversation_messages(query: dict, db, projection: Optional[dict] = None, batch_size: int = 0):
+    """Hot messages matching a _conversation_query, in (timestamp, _id) order.
+
+    $text needs an equality on user_id, the text index prefix, so a keyword
+    filter runs once per participant and the matches are merged.
+    """
+    order = [("timestamp", 1), ("_id", 1)]
+    if "$text" not in query:
+        async for doc in db.chat_messages.find(query, projection, batch_size=batch_size).sort(order):
+            yield doc
+        return
+    fetch = {**projection, "_id": 1, "timestamp": 1} if projection else None
+    results = [
+        await db.chat_messages.find({**query, "user_id": user_id}, fetch).sort(order).to_list(length=None)
+        for user_id in await _conversation_participants(query["conversation_id"], db)
+    ]
+    for doc in heapq.merge(*results, key=lambda doc: (doc["timestamp"], doc["_id"])):
+        yield apply_projection(doc, projection)
+
+async def get_chat_messages(conversation_id: str, db, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, keywords: Optional[List[str]] = None, projection: Optional[dict] = None):
+    archived = await read_archived(conversation_id, db, start_date, end_date, keywords)
+    query = _conversation_query(conversation_id, start_date, end_date, keywords)
+    if not archived:
+        return [doc async for doc in _find_conversation_messages(query, db, projection)]
+    # Fetch full hot documents so the merge can order and dedupe by _id.
+    hot = [doc async for doc in _find_conversation_messages(query, db)]
+    merged = merge_archived(archived, hot)
+    return [apply_projection(doc, projection) for doc in merged]
+
+async def iter_chat_messages(conversation_id: str, db, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, keywords: Optional[List[str]] = None, batch_size: int = 1000):
+    """Yield a conversation's messages oldest first, without _id, one cursor batch at a time.
+
+    Archived messages in range are loaded up front and interleaved with the
+    hot cursor.
+    """
+    archived = await read_archived(conversation_id, db, start_date, end_date, keywords)
+    query = _conversation_query(conversation_id, start_date, end_date, keywords)
+    projection = {**MESSAGE_PROJECTION, "_id": 1} if archived else MESSAGE_PROJECTION
+    cursor = _find_conversation_messages(query, db, projection, batch_size)
+    if not archived:
+        async for doc in cursor:
+            yield doc
+        return
+    pending = 0
+    async for doc in cursor:
+        key = (doc["timestamp"], doc["_id"])
+        while pending < len(archived) and (archived[pending]["timestamp"], archived[pending]["_id"]) <= key:
+            if archived[pending]["_id"] != doc["_id"]:
+                yield apply_projection(archived[pending], MESSAGE_PROJECTION)
+            pending += 1
+        yield apply_projection(doc, MESSAGE_PROJECTION)
+    for doc in archived[pending:]:
+        yield apply_projection(doc, MESSAGE_PROJECTION)
+
+async def count_chat_messages(conversation_id: str, db, limit: int = 0) -> int:
+    return await db.chat_messages.count_documents({"conversation_id": conversation_id}, limit=limit)
+
+async def delete_chat_messages(conversation_id: str, db, batch_size: int = CHAT_DELETE_BATCH_SIZE) -> int:
+    """Delete a conversation, hot and archived, and its derived state.
+
+    Hot messages go in _id batches so no single delete holds the collection
+    or the oplog for long; returns the number of hot messages removed.
+    """
+    deleted = 0
+    while True:
+        cursor = db.chat_messages.find({"conversation_id": conversation_id}, {"_id": 1}).limit(batch_size)
+        ids = [doc["_id"] async for doc in cursor]
+        if not ids:
+            break
+        result = await db.chat_messages.delete_many({"_id": {"$in": ids}})
+        deleted += result.deleted_count
+    await purge_archived_conversation(conversation_id, db)
+    await db.summary_checkpoints.delete_one({"_id": conversation_id})
+    await db.conversations.delete_one({"_id": conversation_id})
+    await db.conversation_vectors.delete_one({"_id": conversation_id})
+    similarity_index.remove(conversation_id)
+    await result_cache.invalidate(db, conversation_id)
+    return deleted
+
+async def get_chat_messages_after(conversation_id: str, db, after_timestamp: datetime, after_id, projection: Optional[dict] = None):
+    """Messages strictly after (after_timestamp, after_id), oldest first."""
+    query = {
+        "conversation_id": conversation_id,
+        "$or": [
+            {"timestamp": {"$gt": after_timestamp}},
+            {"timestamp": after_timestamp, "_id": {"$gt": after_id}},
+        ],
+    }
+    cursor = db.chat_messages.find(query, projection).sort([("timestamp", 1), ("_id", 1)])
     return await cursor.to_list(length=None)
 
-async def delete_chat_messages(conversation_id: str, db):
-    await db.chat_messages.delete_many({"conversation_id": conversation_id})
+EXPORT_PROJECTION = {"conversation_id": 1, "user_id": 1, "message": 1, "timestamp": 1}
+
+async def get_message_position(message_id, db) -> Optional[tuple]:
+    """The (timestamp, _id) keyset position of a message, or None if it is gone."""
+    doc = await db.chat_messages.find_one({"_id": message_id}, {"timestamp": 1})
+    return (doc["timestamp"], doc["_id"]) if doc else None
+
+async def _merge_positions(hot, archived):
+    """Merge two (timestamp, _id)-ordered async streams, preferring the hot copy of a duplicate."""
+    hot_doc = await anext(hot, None)
+    archived_doc = await anext(archived, None)
+    while hot_doc is not None or archived_doc is not None:
+        if archived_doc is None or (hot_doc is not None and (hot_doc["timestamp"], hot_doc["_id"]) <= (archived_doc["timestamp"], archived_doc["_id"])):
+            if archived_doc is not None and archived_doc["_id"] == hot_doc["_id"]:
+                archived_doc = await anext(archived, None)
+            yield hot_doc
+            hot_doc = await anext(hot, None)
+        else:
+            yield archived_doc
+            archived_doc = await anext(archived, None)
+
+async def iter_message_batches(db, conversation_id: Optional[str] = None, user_id: Optional[str] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, after: Optional[tuple] = None, batch_size: int = 5000):
+    """Yield lists of messages in (timestamp, _id) order, ``batch_size`` at a time.
+
+    ``after`` is a (timestamp, _id) position to resume from. Each filter
+    combination is served by one of the (.., timestamp, _id) indexes, so
+    the scan never needs an in-memory sort. Archived messages are merged
+    in, so exports cover cold storage too.
+    """
+    query = {}
+    if conversation_id is not None:
+        query["conversation_id"] = conversation_id
+    if user_id is not None:
+        query["user_id"] = user_id
+    if start_date or end_date:
+        query["timestamp"] = {}
+        if start_date:
+            query["timestamp"]["$gte"] = start_date
+        if end_date:
+            query["timestamp"]["$lte"] = end_date
+    if after is not None:
+        after_timestamp, after_id = after
+        query["$or"] = [
+            {"timestamp": {"$gt": after_timestamp}},
+            {"timestamp": after_timestamp, "_id": {"$gt": after_id}},
+        ]
+    cursor = db.chat_messages.find(query, EXPORT_PROJECTION, batch_size=batch_size).sort([("timestamp", 1), ("_id", 1)])
+    archived = iter_archived(db, conversation_id, user_id, start_date, end_date, after)
+    batch = []
+    async for doc in _merge_positions(cursor, archived):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def get_summary_checkpoint(conversation_id: str, db):
+    return await db.summary_checkpoints.find_one({"_id": conversation_id})
 
-async def get_user_chats(user_id: str, skip: int = 0, limit: int = 10, db=None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, keywords: Optional[List[str]] = None):
+async def get_conversation_message_count(conversation_id: str, db) -> Optional[int]:
+    """Message count from the conversations view, or None if the view has no entry."""
+    doc = await db.conversations.find_one({"_id": conversation_id}, {"message_count": 1})
+    return doc["message_count"] if doc else None
+
+async def save_summary_checkpoint(conversation_id: str, summary: str, last_message: dict, message_count: int, model: str, db):
+    await db.summary_checkpoints.replace_one(
+        {"_id": conversation_id},
+        {
+            "_id": conversation_id,
+            "summary": summary,
+            "last_timestamp": last_message["timestamp"],
+            "last_id": last_message["_id"],
+            "message_count": message_count,
+            "model": model,
+            "updated_at": datetime.utcnow(),
+        },
+        upsert=True,
+    )
+    await db.conversations.update_one(
+        {"_id": conversation_id},
+        {"$set": {"summary_message_count": message_count, "summarized_at": datetime.utcnow()}},
+    )
+
+async def get_user_chats(user_id: str, skip: int = 0, limit: int = 10, db=None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, keywords: Optional[List[str]] = None, after: Optional[tuple] = None):
+    """A page of a user's messages, newest first.
+
+    ``after`` is a decoded (timestamp, _id) cursor; when given, the page
+    starts right after that position and ``skip`` is ignored.
+    """
     query = {"user_id": user_id}
     if start_date or end_date:
         query["timestamp"] = {}
@@ -61,6 +393,115 @@ async def get_user_chats(user_id: str, skip: int = 0, limit: int = 10, db=None,
         if not query["timestamp"]:
             del query["timestamp"]
     if keywords:
-        query["message"] = {"$regex": "|".join(keywords), "$options": "i"}
-    cursor = db.chat_messages.find(query).skip(skip).limit(limit)
-    return await cursor.to_list(length=None) 
\ No newline at end of file
+        query["$text"] = {"$search": build_text_search(keywords)}
+    if after is not None:
+        after_timestamp, after_id = after
+        query["$or"] = [
+            {"timestamp": {"$lt": after_timestamp}},
+            {"timestamp": after_timestamp, "_id": {"$lt": after_id}},
+        ]
+        skip = 0
+    cursor = db.chat_messages.find(query).sort([("timestamp", -1), ("_id", -1)]).skip(skip).limit(limit)
+    return await cursor.to_list(length=None)
+
+def _plan_stages(plan: dict) -> set:
+    stages = {plan.get("stage")}
+    children = list(plan.get("inputStages", []))
+    if "inputStage" in plan:
+        children.append(plan["inputStage"])
+    for child in children:
+        stages |= _plan_stages(child)
+    return stages
+
+async def verify_query_plans(db) -> dict:
+    """Explain the hot read queries and warn if any of them scans the collection."""
+    now = datetime.utcnow()
+    probes = {
+        "user_history": db.chat_messages.find({
+            "user_id": "__probe__",
+            "$or": [{"timestamp": {"$lt": now}}, {"timestamp": now, "_id": {"$lt": ObjectId()}}],
+        }).sort([("timestamp", -1), ("_id", -1)]).limit(10),
+        "conversation": db.chat_messages.find({"conversation_id": "__probe__"}).sort([("timestamp", 1), ("_id", 1)]),
+        "conversation_after": db.chat_messages.find({
+            "conversation_id": "__probe__",
+            "$or": [{"timestamp": {"$gt": now}}, {"timestamp": now, "_id": {"$gt": ObjectId()}}],
+        }).sort([("timestamp", 1), ("_id", 1)]),
+        "user_search": db.chat_messages.find({"user_id": "__probe__", "$text": {"$search": "probe"}}),
+    }
+    results = {}
+    for name, cursor in probes.items():
+        explain = await cursor.explain()
+        stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        index_scan = "COLLSCAN" not in stages and bool(stages & {"IXSCAN", "EXPRESS_IXSCAN"})
+        results[name] = {"index_scan": index_scan, "stages": sorted(s for s in stages if s)}
+        if not index_scan:
+            logger.warning("Query %s is not served by an index scan: %s", name, results[name]["stages"])
+    return results
+
+async def search_user_messages(user_id: str, db, keywords: Optional[List[str]] = None, phrases: Optional[List[str]] = None, conversation_id: Optional[str] = None, limit: int = 20):
+    """Full-text search across a user's messages, best matches first."""
+    query = {"user_id": user_id, "$text": {"$search": build_text_search(keywords, phrases)}}
+    if conversation_id:
+        query["conversation_id"] = conversation_id
+    projection = {"_id": 0, "score": {"$meta": "textScore"}}
+    cursor = db.chat_messages.find(query, projection).sort([("score", {"$meta": "textScore"}), ("timestamp", -1)]).limit(limit)
+    return await cursor.to_list(length=None)
+
+async def get_user_conversations(user_id: str, db, limit: int = 20, before: Optional[datetime] = None):
+    """A user's conversations from the materialized view, most recently active first."""
+    query = {"participants": user_id}
+    if before is not None:
+        query["last_activity"] = {"$lt": before}
+    cursor = db.conversations.find(query).sort("last_activity", -1).limit(limit)
+    return await cursor.to_list(length=None)
+
+async def rebuild_conversation_aggregates(db) -> int:
+    """Recompute the conversations view from chat_messages and the archive catalog.
+
+    Archived messages stay counted, as they are by the incremental
+    updates, using the per-conversation counts each archive segment
+    records. Counts and activity bounds are replaced; summary fields on
+    existing documents are kept. Conversations that no longer have
+    messages are removed. Returns the number of conversations in the view.
+    """
+    await backfill_conversation_counts(db)
+    rebuilt_at = datetime.utcnow()
+    pipeline = [
+        {"$group": {
+            "_id": "$conversation_id",
+            "message_count": {"$sum": 1},
+            "first_activity": {"$min": "$timestamp"},
+            "last_activity": {"$max": "$timestamp"},
+            "participants": {"$addToSet": "$user_id"},
+        }},
+        {"$unionWith": {"coll": "archive_segments", "pipeline": [
+            {"$unwind": "$conversations"},
+            {"$project": {
+                "_id": "$conversations.conversation_id",
+                "message_count": "$conversations.count",
+                "first_activity": "$conversations.first_timestamp",
+                "last_activity": "$conversations.last_timestamp",
+                "participants": ["$user_id"],
+            }},
+        ]}},
+        {"$group": {
+            "_id": "$_id",
+            "message_count": {"$sum": "$message_count"},
+            "first_activity": {"$min": "$first_activity"},
+            "last_activity": {"$max": "$last_activity"},
+            "participants": {"$push": "$participants"},
+        }},
+        {"$set": {
+            "participants": {"$reduce": {
+                "input": "$participants",
+                "initialValue": [],
+                "in": {"$setUnion": ["$$value", "$$this"]},
+            }},
+            "rebuilt_at": rebuilt_at,
+        }},
+        {"$merge": {"into": "conversations", "on": "_id", "whenMatched": "merge", "whenNotMatched": "insert"}},
+    ]
+    async for _ in db.chat_messages.aggregate(pipeline, allowDiskUse=True):
+        pass
+    await db.conversations.delete_many({"rebuilt_at": {"$ne": rebuilt_at}})
+    return await db.conversations.count_documents({})
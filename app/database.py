@@ -1,19 +1,136 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from app.metrics import command_metrics
 import os
+import threading
+import time
 from dotenv import load_dotenv
 load_dotenv()
 
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+DATABASE_NAME = os.getenv("DATABASE_NAME", "chat_db")
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "60000"))
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000"))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "30000"))
+
+client = None
+db = None
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Collects connection pool counters for the shared client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.open_connections = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.pool_clears = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections = max(self.open_connections - 1, 0)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        duration = getattr(event, "duration", None)
+        if duration is not None:
+            wait_ms = duration * 1000
+        else:
+            started = getattr(self._local, "started", None)
+            wait_ms = (time.perf_counter() - started) * 1000 if started else 0.0
+        self._local.started = None
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "max_pool_size": MONGODB_MAX_POOL_SIZE,
+                "min_pool_size": MONGODB_MIN_POOL_SIZE,
+                "open_connections": self.open_connections,
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "avg_wait_ms": self.total_wait_ms / self.checkouts if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait_ms,
+                "pool_clears": self.pool_clears,
+            }
+
+
+pool_stats = PoolStatsListener()
+
 
 def get_db():
-    client = AsyncIOMotorClient(MONGODB_URI)
-    return client["chat_db"]
+    if db is None:
+        raise RuntimeError("MongoDB client is not initialized; call connect_to_mongodb() first")
+    return db
 
 async def connect_to_mongodb():
     global client, db
-    client = AsyncIOMotorClient(MONGODB_URI)
-    db = client["chat_db"]
+    if client is not None:
+        return
+    client = AsyncIOMotorClient(
+        MONGODB_URI,
+        maxPoolSize=MONGODB_MAX_POOL_SIZE,
+        minPoolSize=MONGODB_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS,
+        event_listeners=[pool_stats, command_metrics],
+    )
+    db = client[DATABASE_NAME]
 
 async def close_mongodb_connection():
-    if client:
-        client.close() 
\ No newline at end of file
+    global client, db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
+
+def get_pool_stats():
+    return pool_stats.snapshot()
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import zlib
+from typing import AsyncIterator, List
+from app.pagination import encode_cursor
+from app.serialization import dumps
+from dotenv import load_dotenv
+load_dotenv()
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - pyarrow is optional
+    pyarrow = None
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+# Level 1 compresses NDJSON chat text to roughly a quarter of its size at a
+# fraction of the CPU cost of the default level 6.
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "1"))
+
+EXPORT_FORMATS = {
+    "ndjson.gz": ("application/gzip", "ndjson.gz"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+ARROW_FORMATS = {"arrow", "parquet"}
+
+
+def arrow_available() -> bool:
+    return pyarrow is not None
+
+
+def encode_ndjson(batch: List[dict]) -> bytes:
+    lines = []
+    for doc in batch:
+        doc["cursor"] = encode_cursor(doc)
+        doc["_id"] = str(doc["_id"])
+        lines.append(dumps(doc))
+    lines.append(b"")
+    return b"\n".join(lines)
+
+
+async def ndjson_stream(batches: AsyncIterator[List[dict]], compress: bool = True) -> AsyncIterator[bytes]:
+    """Encode message batches as NDJSON, gzip-compressed unless ``compress`` is False.
+
+    Compression runs on the default executor; zlib releases the GIL, so the
+    event loop keeps serving while a batch is being deflated.
+    """
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+    async for batch in batches:
+        data = encode_ndjson(batch)
+        if compressor is not None:
+            data = await asyncio.to_thread(compressor.compress, data)
+        if data:
+            yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+class _ChunkSink:
+    """Write-only file object that hands pyarrow's output back in chunks."""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _arrow_schema():
+    return pyarrow.schema([
+        ("_id", pyarrow.string()),
+        ("conversation_id", pyarrow.string()),
+        ("user_id", pyarrow.string()),
+        ("message", pyarrow.string()),
+        ("timestamp", pyarrow.timestamp("ms")),
+        ("cursor", pyarrow.string()),
+    ])
+
+
+def _record_batch(batch: List[dict], schema):
+    return pyarrow.record_batch([
+        pyarrow.array([str(doc["_id"]) for doc in batch], pyarrow.string()),
+        pyarrow.array([doc["conversation_id"] for doc in batch], pyarrow.string()),
+        pyarrow.array([doc["user_id"] for doc in batch], pyarrow.string()),
+        pyarrow.array([doc["message"] for doc in batch], pyarrow.string()),
+        pyarrow.array([doc["timestamp"] for doc in batch], pyarrow.timestamp("ms")),
+        pyarrow.array([encode_cursor(doc) for doc in batch], pyarrow.string()),
+    ], schema=schema)
+
+
+async def arrow_stream(batches: AsyncIterator[List[dict]], fmt: str) -> AsyncIterator[bytes]:
+    """Encode message batches as an Arrow IPC stream or as Parquet.
+
+    Every cursor batch becomes one record batch (Parquet: one row group),
+    so memory stays bounded by EXPORT_BATCH_SIZE either way.
+    """
+    schema = _arrow_schema()
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+    try:
+        async for batch in batches:
+            await asyncio.to_thread(writer.write_batch, _record_batch(batch, schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
@@ -0,0 +1,151 @@
+import os
+import re
+from collections import defaultdict
+from itertools import count
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+# TextRank builds an n x n similarity matrix, so only this many sentences,
+# preselected by similarity to the conversation centroid, are ranked.
+TEXTRANK_MAX_SENTENCES = int(os.getenv("TEXTRANK_MAX_SENTENCES", "300"))
+# Longer conversations are sampled evenly down to this many sentences
+# (messages, for keywords) so fast mode stays fast at any size.
+EXTRACTIVE_MAX_DOCUMENTS = int(os.getenv("EXTRACTIVE_MAX_DOCUMENTS", "5000"))
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he her
+here hers herself him himself his how i if in into is it its itself just me more most my myself no nor not
+now of off on once only or other our ours ourselves out over own same she should so some such than that the
+their theirs them themselves then there these they this those through to too under until up very was we
+were what when where which while who whom why will with would you your yours yourself yourselves also get
+got im ive dont cant wont thats yeah ok okay thanks hi hello hey please lets let us one like
+""".split())
+
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n+")
+_TOKEN = re.compile(r"[a-z0-9][a-z0-9'_-]*")
+
+
+def split_sentences(texts: list[str]) -> list[str]:
+    sentences = []
+    for text in texts:
+        for sentence in _SENTENCE.split(text):
+            sentence = sentence.strip()
+            if len(sentence) > 1:
+                sentences.append(sentence)
+    return sentences
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased content words of text, stopwords removed."""
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def tfidf_entries(documents: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray, list[str]]:
+    """Sparse L2-normalized TF-IDF in coordinate form: (rows, cols, values, terms).
+
+    Only nonzero entries are materialized, so memory grows with the text
+    rather than with documents x vocabulary.
+    """
+    vocabulary = defaultdict(count().__next__)
+    rows, cols = [], []
+    for row, doc in enumerate(documents):
+        doc_cols = [vocabulary[token] for token in tokenize(doc)]
+        rows.extend([row] * len(doc_cols))
+        cols.extend(doc_cols)
+    terms = list(vocabulary)
+    if not rows:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.float32), terms
+    width = len(terms)
+    keys, counts = np.unique(np.asarray(rows, np.int64) * width + np.asarray(cols, np.int64), return_counts=True)
+    rows, cols = keys // width, keys % width
+    df = np.bincount(cols, minlength=width)
+    idf = np.log((1 + len(documents)) / (1 + df)) + 1.0
+    values = np.log1p(counts) * idf[cols]
+    norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=len(documents)))
+    return rows, cols, (values / norms[rows]).astype(np.float32), terms
+
+
+def tfidf_matrix(documents: list[str]) -> tuple[np.ndarray, list[str]]:
+    """Dense TF-IDF rows (float32) for small document sets, plus the vocabulary."""
+    rows, cols, values, terms = tfidf_entries(documents)
+    matrix = np.zeros((len(documents), max(len(terms), 1)), dtype=np.float32)
+    matrix[rows, cols] = values
+    return matrix, terms
+
+
+def centroid_scores(rows: np.ndarray, cols: np.ndarray, values: np.ndarray, n: int) -> np.ndarray:
+    """Cosine-style similarity of each row to the mean row, in O(nonzeros)."""
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    centroid = np.bincount(cols, weights=values) / n
+    return np.bincount(rows, weights=values * centroid[cols], minlength=n)
+
+
+def textrank(matrix: np.ndarray, damping: float = 0.85, iterations: int = 50, tol: float = 1e-6) -> np.ndarray:
+    """PageRank over the cosine-similarity graph of the rows of matrix."""
+    n = matrix.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    similarity = matrix @ matrix.T
+    np.fill_diagonal(similarity, 0.0)
+    out_weight = similarity.sum(axis=1, keepdims=True)
+    transition = np.divide(similarity, out_weight, out=np.full_like(similarity, 1.0 / n), where=out_weight > 0)
+    scores = np.full(n, 1.0 / n, dtype=np.float32)
+    for _ in range(iterations):
+        updated = (1 - damping) / n + damping * (transition.T @ scores)
+        if np.abs(updated - scores).sum() < tol:
+            return updated
+        scores = updated
+    return scores
+
+
+def _sample(items: list, limit: int = EXTRACTIVE_MAX_DOCUMENTS) -> list:
+    """At most limit items, evenly spaced so the whole conversation is covered."""
+    if len(items) <= limit:
+        return items
+    return [items[i] for i in np.linspace(0, len(items) - 1, limit).astype(np.int64)]
+
+
+def top_sentences(texts: list[str], limit: int = 5) -> list[str]:
+    """The limit highest-ranked sentences, in their original order."""
+    sentences = _sample(split_sentences(_sample(texts)))
+    if len(sentences) <= limit:
+        return sentences
+    candidates = np.arange(len(sentences))
+    if len(sentences) > TEXTRANK_MAX_SENTENCES:
+        rows, cols, values, _ = tfidf_entries(sentences)
+        scores = centroid_scores(rows, cols, values, len(sentences))
+        candidates = np.sort(np.argsort(-scores, kind="stable")[:max(TEXTRANK_MAX_SENTENCES, limit)])
+    matrix, _ = tfidf_matrix([sentences[i] for i in candidates])
+    scores = textrank(matrix)
+    best = np.argsort(-scores, kind="stable")[:limit]
+    return [sentences[candidates[i]] for i in sorted(best)]
+
+
+def extract_keywords(texts: list[str], limit: int = 10) -> list[str]:
+    """Terms with the highest summed TF-IDF weight across messages."""
+    if not texts:
+        return []
+    _, cols, values, terms = tfidf_entries(_sample(texts))
+    if not terms:
+        return []
+    weights = np.bincount(cols, weights=values, minlength=len(terms))
+    best = np.argsort(-weights, kind="stable")[:limit]
+    return [terms[i] for i in best if weights[i] > 0]
+
+
+def fast_summary(texts: list[str], sentences: int = 5) -> str:
+    return " ".join(top_sentences(texts, sentences))
+
+
+def fast_insight(texts: list[str], insight_type: str) -> str:
+    if insight_type == "keywords":
+        return ", ".join(extract_keywords(texts))
+    if insight_type == "highlights":
+        return "\n".join(f"- {sentence}" for sentence in top_sentences(texts, 5))
+    raise ValueError(f"Fast mode does not support insight type: {insight_type}")
+
+
+FAST_INSIGHT_TYPES = ("keywords", "highlights")
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import os
+from typing import AsyncIterator, Iterable, List, Optional
+from pydantic import ValidationError
+from app.crud import prepare_chat_document, insert_chat_documents
+from app.schemas import ChatMessageCreate
+from dotenv import load_dotenv
+load_dotenv()
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+WRITE_BEHIND_ENABLED = os.getenv("CHAT_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+WRITE_BEHIND_WINDOW_MS = float(os.getenv("CHAT_WRITE_BEHIND_WINDOW_MS", "5"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("CHAT_WRITE_BEHIND_MAX_BATCH", "500"))
+
+
+class BulkIngestResult:
+    def __init__(self):
+        self.received = 0
+        self.inserted = 0
+        self.errors: List[dict] = []
+
+    def as_dict(self):
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "failed": len(self.errors),
+            "errors": self.errors,
+        }
+
+
+async def _flush_chunk(chunk: List[tuple], result: BulkIngestResult, db):
+    documents = [doc for _, doc in chunk]
+    failures = await insert_chat_documents(documents, db)
+    for failure in failures:
+        result.errors.append({"index": chunk[failure["index"]][0], "error": failure["error"]})
+    result.inserted += len(chunk) - len(failures)
+    chunk.clear()
+
+
+async def ingest_rows(rows: AsyncIterator, db, chunk_size: int = BULK_CHUNK_SIZE) -> BulkIngestResult:
+    """Validate rows against ChatMessageCreate and write them in bounded chunks.
+
+    ``rows`` yields either parsed objects or ``ValueError`` instances for
+    lines that could not be decoded; both are reported by their position.
+    """
+    result = BulkIngestResult()
+    chunk: List[tuple] = []
+    index = 0
+    async for row in rows:
+        result.received += 1
+        if isinstance(row, ValueError):
+            result.errors.append({"index": index, "error": str(row)})
+        else:
+            try:
+                chat = ChatMessageCreate(**row) if isinstance(row, dict) else None
+                if chat is None:
+                    raise ValueError("row must be a JSON object")
+                chunk.append((index, prepare_chat_document(chat)))
+            except (ValidationError, ValueError, TypeError) as e:
+                result.errors.append({"index": index, "error": str(e)})
+        if len(chunk) >= chunk_size:
+            await _flush_chunk(chunk, result, db)
+        index += 1
+    if chunk:
+        await _flush_chunk(chunk, result, db)
+    result.errors.sort(key=lambda err: err["index"])
+    return result
+
+
+async def iter_json_array(rows: Iterable) -> AsyncIterator:
+    for row in rows:
+        yield row
+
+
+async def iter_ndjson(stream: AsyncIterator[bytes]) -> AsyncIterator:
+    """Parse an NDJSON byte stream line by line without buffering the body."""
+    buffer = b""
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield ValueError(f"invalid JSON: {e}")
+    if buffer.strip():
+        try:
+            yield json.loads(buffer)
+        except ValueError as e:
+            yield ValueError(f"invalid JSON: {e}")
+
+
+class GroupCommitWriter:
+    """Write-behind batcher for single-message inserts.
+
+    Messages submitted within ``window_ms`` of each other are written with a
+    single unordered insert_many; each caller awaits the outcome of its row.
+    """
+
+    def __init__(self, window_ms: float = WRITE_BEHIND_WINDOW_MS, max_batch: int = WRITE_BEHIND_MAX_BATCH):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._db = None
+        self.batches = 0
+        self.messages = 0
+
+    def start(self, db):
+        if self._task is not None:
+            return
+        self._db = db
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._queue = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def submit(self, chat: ChatMessageCreate):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((prepare_chat_document(chat), future))
+        await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._commit(batch)
+
+    async def _commit(self, batch: List[tuple]):
+        try:
+            failures = await insert_chat_documents([doc for doc, _ in batch], self._db)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        failed = {failure["index"]: failure["error"] for failure in failures}
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if i in failed:
+                future.set_exception(RuntimeError(failed[i]))
+            else:
+                future.set_result(None)
+        self.batches += 1
+        self.messages += len(batch)
+
+    def stats(self):
+        return {
+            "enabled": self.running,
+            "batches": self.batches,
+            "messages": self.messages,
+            "avg_batch_size": self.messages / self.batches if self.batches else 0.0,
+        }
+
+
+write_behind = GroupCommitWriter()
@@ -0,0 +1,222 @@
+import asyncio
+import itertools
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+from pymongo import ReturnDocument
+from app.services import summarize_conversation, conversation_insights, ConversationNotFound
+from app.crud import delete_chat_messages
+from dotenv import load_dotenv
+load_dotenv()
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAXSIZE = int(os.getenv("JOB_QUEUE_MAXSIZE", "1000"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY_SECONDS = float(os.getenv("JOB_RETRY_DELAY_SECONDS", "2"))
+# A running job whose owner stops heartbeating for this long is presumed dead.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))
+
+
+class QueueFull(Exception):
+    pass
+
+
+async def _run_summarize(job, db):
+    return {"summary": await summarize_conversation(job["conversation_id"], db, job.get("rebuild", False))}
+
+async def _run_insights(job, db):
+    return {"insights": await conversation_insights(job["conversation_id"], job["insight_types"], db)}
+
+async def _run_delete(job, db):
+    return {"deleted": await delete_chat_messages(job["conversation_id"], db)}
+
+HANDLERS = {
+    "summarize": _run_summarize,
+    "insights": _run_insights,
+    "delete": _run_delete,
+}
+
+
+class JobQueue:
+    """Bounded priority queue of LLM jobs, persisted in the jobs collection.
+
+    Job state lives in Mongo so it can be polled from any request and
+    recovered after a restart; dispatch happens through an in-process
+    priority queue drained by a fixed pool of workers. Lower priority
+    values run first. A claimed job records this queue's ``owner`` and is
+    heartbeated while it runs, so other processes only recover it once
+    the lease lapses.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, maxsize: int = JOB_QUEUE_MAXSIZE,
+                 lease_seconds: float = JOB_LEASE_SECONDS):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.lease_seconds = lease_seconds
+        self.owner = uuid.uuid4().hex
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: list[asyncio.Task] = []
+        self._retry_tasks: set[asyncio.Task] = set()
+        # Slots promised to enqueue calls still writing their job document.
+        self._reserved = 0
+        self._seq = itertools.count()
+        self._db = None
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.recovered = 0
+
+    async def start(self, db):
+        if self._tasks:
+            return
+        self._db = db
+        self._queue = asyncio.PriorityQueue(maxsize=self.maxsize)
+        # Re-dispatch queued work, plus running jobs whose owner stopped
+        # heartbeating. Jobs held by a live process are left alone.
+        stale = datetime.utcnow() - timedelta(seconds=self.lease_seconds)
+        cursor = db.jobs.find({"$or": [
+            {"status": "queued"},
+            {"status": "running", "updated_at": {"$lt": stale}},
+        ]}).sort([("priority", 1), ("created_at", 1)])
+        async for job in cursor:
+            if self._queue.full():
+                break
+            if job["status"] == "running":
+                reset = await db.jobs.update_one(
+                    {"_id": job["_id"], "status": "running", "updated_at": {"$lt": stale}},
+                    {"$set": {"status": "queued", "owner": None, "updated_at": datetime.utcnow()}},
+                )
+                if not reset.modified_count:
+                    continue
+                self.recovered += 1
+            self._queue.put_nowait((job["priority"], next(self._seq), job["_id"]))
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Pending retries stay "queued" in Mongo and are re-dispatched on the next start.
+        tasks = self._tasks + list(self._retry_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._retry_tasks.clear()
+        if self._db is not None:
+            # Hand jobs interrupted by this shutdown back without waiting out the lease.
+            await self._db.jobs.update_many(
+                {"status": "running", "owner": self.owner},
+                {"$set": {"status": "queued", "owner": None, "updated_at": datetime.utcnow()}},
+            )
+
+    async def enqueue(self, job_type: str, params: dict, priority: int = 5) -> str:
+        if job_type not in HANDLERS:
+            raise ValueError(f"Unknown job type: {job_type}")
+        if self._queue is None or self._queue.qsize() + self._reserved >= self.maxsize:
+            raise QueueFull()
+        job_id = uuid.uuid4().hex
+        now = datetime.utcnow()
+        self._reserved += 1
+        try:
+            await self._db.jobs.insert_one({
+                "_id": job_id,
+                "type": job_type,
+                "status": "queued",
+                "priority": priority,
+                "attempts": 0,
+                "owner": None,
+                "result": None,
+                "error": None,
+                "created_at": now,
+                "updated_at": now,
+                **params,
+            })
+        finally:
+            self._reserved -= 1
+        try:
+            self._queue.put_nowait((priority, next(self._seq), job_id))
+        except asyncio.QueueFull:
+            # A retry took the slot meanwhile; don't leave an orphaned job behind.
+            await self._db.jobs.delete_one({"_id": job_id})
+            raise QueueFull()
+        return job_id
+
+    async def get(self, job_id: str):
+        return await self._db.jobs.find_one({"_id": job_id})
+
+    async def _requeue_later(self, priority: int, job_id: str, delay: float):
+        await asyncio.sleep(delay)
+        await self._queue.put((priority, next(self._seq), job_id))
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await self._db.jobs.update_one(
+                {"_id": job_id, "status": "running", "owner": self.owner},
+                {"$set": {"updated_at": datetime.utcnow()}},
+            )
+
+    async def _worker(self):
+        db = self._db
+        while True:
+            priority, _, job_id = await self._queue.get()
+            try:
+                job = await db.jobs.find_one_and_update(
+                    {"_id": job_id, "status": "queued"},
+                    {"$set": {"status": "running", "owner": self.owner, "updated_at": datetime.utcnow()},
+                     "$inc": {"attempts": 1}},
+                    return_document=ReturnDocument.AFTER,
+                )
+                if job is None:
+                    continue
+                heartbeat = asyncio.create_task(self._heartbeat(job_id))
+                try:
+                    result = await HANDLERS[job["type"]](job, db)
+                except ConversationNotFound:
+                    await self._finish(job_id, "failed", error="Conversation not found")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if job["attempts"] < JOB_MAX_ATTEMPTS:
+                        self.retried += 1
+                        await db.jobs.update_one(
+                            {"_id": job_id, "owner": self.owner},
+                            {"$set": {"status": "queued", "owner": None, "error": str(e),
+                                      "updated_at": datetime.utcnow()}},
+                        )
+                        delay = JOB_RETRY_DELAY_SECONDS * 2 ** (job["attempts"] - 1)
+                        task = asyncio.create_task(self._requeue_later(priority, job_id, delay))
+                        self._retry_tasks.add(task)
+                        task.add_done_callback(self._retry_tasks.discard)
+                    else:
+                        await self._finish(job_id, "failed", error=str(e))
+                else:
+                    await self._finish(job_id, "succeeded", result=result)
+                finally:
+                    heartbeat.cancel()
+            finally:
+                self._queue.task_done()
+
+    async def _finish(self, job_id: str, status: str, result=None, error=None):
+        if status == "succeeded":
+            self.completed += 1
+        else:
+            self.failed += 1
+        await self._db.jobs.update_one(
+            {"_id": job_id, "owner": self.owner},
+            {"$set": {"status": status, "result": result, "error": error, "updated_at": datetime.utcnow()}},
+        )
+
+    def stats(self):
+        return {
+            "workers": len(self._tasks),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_size": self.maxsize,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "retries_pending": len(self._retry_tasks),
+            "recovered": self.recovered,
+        }
+
+
+job_queue = JobQueue()
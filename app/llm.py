@@ -2,31 +2,379 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+import asyncio
+import hashlib
+import json
 import os
-from fastapi.concurrency import run_in_threadpool
+import random
+import time
+from typing import AsyncIterator
+from app.metrics import (
+    LLM_CALL_DURATION, LLM_QUEUE_DELAY, LLM_PROMPT_CHARS, LLM_RESPONSE_CHARS, LLM_ERRORS, LLM_RETRIES,
+    record_span,
+)
 
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash-8b")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_RATE_LIMIT_PER_SEC = float(os.getenv("LLM_RATE_LIMIT_PER_SEC", "0"))
+LLM_RATE_LIMIT_BURST = int(os.getenv("LLM_RATE_LIMIT_BURST", "10"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "20"))
+LLM_FAKE_LATENCY_MS = float(os.getenv("LLM_FAKE_LATENCY_MS", "50"))
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "6000"))
+SUMMARY_CHUNK_THRESHOLD_TOKENS = int(os.getenv("SUMMARY_CHUNK_THRESHOLD_TOKENS", "24000"))
+SUMMARY_MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", "4"))
+
+
+class LLMRateLimitError(Exception):
+    """Raised by providers when the backend rejects a call for quota reasons."""
+
+
+class LLMUnavailableError(Exception):
+    """Raised by providers when the backend fails for reasons other than quota."""
+
+
+class LLMProvider:
+    model_name = "unknown"
+
+    async def generate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        # Providers without native streaming deliver the completion in one piece.
+        yield await self.generate(prompt)
+
+
+class GeminiProvider(LLMProvider):
+    def __init__(self, model_name: str = GEMINI_MODEL):
+        self.model_name = model_name
+        self._model = genai.GenerativeModel(model_name)
+
+    async def generate(self, prompt: str) -> str:
+        try:
+            response = await self._model.generate_content_async(prompt)
+        except (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests,
+                google_exceptions.ServiceUnavailable) as e:
+            raise LLMRateLimitError(str(e)) from e
+        except google_exceptions.GoogleAPIError as e:
+            raise LLMUnavailableError(str(e)) from e
+        return response.text
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        try:
+            response = await self._model.generate_content_async(prompt, stream=True)
+        except (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests,
+                google_exceptions.ServiceUnavailable) as e:
+            raise LLMRateLimitError(str(e)) from e
+        except google_exceptions.GoogleAPIError as e:
+            raise LLMUnavailableError(str(e)) from e
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeProvider(LLMProvider):
+    """Deterministic offline backend for load tests and local development."""
+
+    model_name = "fake"
+
+    def __init__(self, latency_ms: float = LLM_FAKE_LATENCY_MS):
+        self.latency = latency_ms / 1000
+
+    async def generate(self, prompt: str) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:12]
+        first_line = prompt.split("\n", 1)[0]
+        return f"[fake:{digest}] {first_line} ({len(prompt)} chars)"
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        words = (await self.generate(prompt)).split(" ")
+        for i, word in enumerate(words):
+            yield word if i == 0 else " " + word
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class LLMClient:
+    """Long-lived LLM client: shared provider, concurrency cap, rate limit, retries and timeouts."""
+
+    def __init__(self, provider: LLMProvider):
+        self.provider = provider
+        self._semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        self._bucket = TokenBucket(LLM_RATE_LIMIT_PER_SEC, LLM_RATE_LIMIT_BURST)
+        self._label = type(provider).__name__
+        self.calls = 0
+        self.retries = 0
+        self.errors = 0
+
+    @property
+    def model_name(self) -> str:
+        return self.provider.model_name
+
+    async def generate(self, prompt: str, timeout: float = LLM_TIMEOUT_SECONDS) -> str:
+        provider = self._label
+        LLM_PROMPT_CHARS.labels(provider).observe(len(prompt))
+        attempt = 0
+        while True:
+            queued = time.perf_counter()
+            await self._bucket.acquire()
+            try:
+                async with self._semaphore:
+                    started = time.perf_counter()
+                    LLM_QUEUE_DELAY.labels(provider).observe(started - queued)
+                    self.calls += 1
+                    try:
+                        text = await asyncio.wait_for(self.provider.generate(prompt), timeout)
+                    finally:
+                        duration = time.perf_counter() - started
+                        LLM_CALL_DURATION.labels(provider, "generate").observe(duration)
+                        record_span("llm.generate", started, duration)
+                    LLM_RESPONSE_CHARS.labels(provider).observe(len(text))
+                    return text
+            except LLMRateLimitError:
+                if attempt >= LLM_MAX_RETRIES:
+                    self.errors += 1
+                    LLM_ERRORS.labels(provider, "rate_limit").inc()
+                    raise
+            except Exception as e:
+                self.errors += 1
+                LLM_ERRORS.labels(provider, type(e).__name__).inc()
+                raise
+            self.retries += 1
+            LLM_RETRIES.labels(provider).inc()
+            delay = min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            attempt += 1
+
+    async def stream(self, prompt: str, timeout: float = LLM_TIMEOUT_SECONDS) -> AsyncIterator[str]:
+        """Yield completion chunks as the provider produces them.
+
+        Quota errors are retried only until the first chunk arrives; the
+        timeout applies to each wait for the next chunk. Closing the
+        generator (e.g. on client disconnect) closes the upstream stream.
+        """
+        provider = self._label
+        LLM_PROMPT_CHARS.labels(provider).observe(len(prompt))
+        attempt = 0
+        while True:
+            queued = time.perf_counter()
+            await self._bucket.acquire()
+            async with self._semaphore:
+                started = time.perf_counter()
+                LLM_QUEUE_DELAY.labels(provider).observe(started - queued)
+                self.calls += 1
+                chunks = self.provider.stream(prompt)
+                first_chunk = False
+                size = 0
+                try:
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                        except StopAsyncIteration:
+                            LLM_RESPONSE_CHARS.labels(provider).observe(size)
+                            return
+                        first_chunk = True
+                        size += len(chunk)
+                        yield chunk
+                except LLMRateLimitError:
+                    if first_chunk or attempt >= LLM_MAX_RETRIES:
+                        self.errors += 1
+                        LLM_ERRORS.labels(provider, "rate_limit").inc()
+                        raise
+                except (asyncio.CancelledError, GeneratorExit):
+                    raise
+                except Exception as e:
+                    self.errors += 1
+                    LLM_ERRORS.labels(provider, type(e).__name__).inc()
+                    raise
+                finally:
+                    await chunks.aclose()
+                    duration = time.perf_counter() - started
+                    LLM_CALL_DURATION.labels(provider, "stream").observe(duration)
+                    record_span("llm.stream", started, duration)
+            self.retries += 1
+            LLM_RETRIES.labels(provider).inc()
+            delay = min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            attempt += 1
+
+    def stats(self):
+        return {
+            "provider": type(self.provider).__name__,
+            "model": self.model_name,
+            "max_concurrency": LLM_MAX_CONCURRENCY,
+            "calls": self.calls,
+            "retries": self.retries,
+            "errors": self.errors,
+        }
+
+
+def create_provider(name: str = LLM_PROVIDER) -> LLMProvider:
+    if name == "fake":
+        return FakeProvider()
+    if name == "gemini":
+        return GeminiProvider()
+    raise ValueError(f"Unknown LLM provider: {name}")
+
+
+llm_client = LLMClient(create_provider())
+MODEL_NAME = llm_client.model_name
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text.
+    return len(text) // 4 + 1
+
+def estimate_messages_tokens(messages: list[str]) -> int:
+    return sum(estimate_tokens(msg) for msg in messages)
+
+def chunk_messages(messages: list[str], max_tokens: int) -> list[list[str]]:
+    """Split messages into consecutive windows of at most max_tokens each."""
+    chunks, current, current_tokens = [], [], 0
+    for msg in messages:
+        tokens = estimate_tokens(msg)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(msg)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+def summary_prompt(messages: list[str]) -> str:
+    return "Summarize the following conversation:\n" + "\n".join(messages)
+
 async def summarize_chat(messages: list[str]) -> str:
-    prompt = "Summarize the following conversation:\n" + "\n".join(messages)
-    model = genai.GenerativeModel("gemini-1.5-flash-8b")
-    def sync_call():
-        return model.generate_content(prompt).text
-    return await run_in_threadpool(sync_call)
+    return await llm_client.generate(summary_prompt(messages))
 
-async def chat_insights(messages: list[str], insight_type: str) -> str:
-    base = "\n".join(messages)
-    if insight_type == "sentiment":
-        prompt = f"Analyze the overall sentiment (positive, negative, neutral) of the following conversation:\n{base}"
-    elif insight_type == "keywords":
-        prompt = f"Extract the main topics or keywords from the following conversation:\n{base}"
-    elif insight_type == "actions":
-        prompt = f"List all action items or tasks mentioned in the following conversation:\n{base}"
-    elif insight_type == "highlights":
-        prompt = f"Extract the most important highlights from the following conversation:\n{base}"
+async def _summarize_part(messages: list[str], partial: bool) -> str:
+    if partial:
+        prompt = "Summarize the following partial summaries of one conversation into a single summary:\n" + "\n\n".join(messages)
     else:
-        prompt = f"Provide insights for the following conversation:\n{base}"
-    model = genai.GenerativeModel("gemini-1.5-flash-8b")
-    def sync_call():
-        return model.generate_content(prompt).text
-    return await run_in_threadpool(sync_call) 
\ No newline at end of file
+        prompt = "Summarize the following excerpt of a longer conversation:\n" + "\n".join(messages)
+    return await llm_client.generate(prompt)
+
+async def summarize_chat_chunked(
+    messages: list[str],
+    chunk_tokens: int = SUMMARY_CHUNK_TOKENS,
+    max_concurrency: int = SUMMARY_MAP_CONCURRENCY,
+) -> str:
+    """Map-reduce summarization for conversations larger than the model context.
+
+    Messages are split into token-budgeted windows that are summarized
+    concurrently; the partial summaries are then reduced the same way until
+    they fit in a single window.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(chunk, partial):
+        async with semaphore:
+            return await _summarize_part(chunk, partial)
+
+    parts, partial = messages, False
+    while True:
+        chunks = chunk_messages(parts, chunk_tokens)
+        if partial and len(chunks) == len(parts) > 1:
+            # Oversized partials would never shrink; pair them up instead.
+            chunks = [parts[i:i + 2] for i in range(0, len(parts), 2)]
+        if len(chunks) == 1:
+            if partial:
+                return await run(chunks[0], True)
+            return await summarize_chat(chunks[0])
+        parts = await asyncio.gather(*(run(chunk, partial) for chunk in chunks))
+        partial = True
+
+def refine_prompt(previous_summary: str, messages: list[str]) -> str:
+    return (
+        "Here is a summary of a conversation so far:\n" + previous_summary +
+        "\n\nUpdate the summary to also cover the following new messages:\n" + "\n".join(messages)
+    )
+
+async def refine_summary(previous_summary: str, messages: list[str]) -> str:
+    return await llm_client.generate(refine_prompt(previous_summary, messages))
+
+INSIGHT_INSTRUCTIONS = {
+    "sentiment": "Analyze the overall sentiment (positive, negative, neutral) of the following conversation",
+    "keywords": "Extract the main topics or keywords from the following conversation",
+    "actions": "List all action items or tasks mentioned in the following conversation",
+    "highlights": "Extract the most important highlights from the following conversation",
+}
+DEFAULT_INSIGHT_INSTRUCTION = "Provide insights for the following conversation"
+
+def insight_prompt(messages: list[str], insight_type: str) -> str:
+    base = "\n".join(messages)
+    instruction = INSIGHT_INSTRUCTIONS.get(insight_type, DEFAULT_INSIGHT_INSTRUCTION)
+    return f"{instruction}:\n{base}"
+
+async def chat_insights(messages: list[str], insight_type: str) -> str:
+    return await llm_client.generate(insight_prompt(messages, insight_type))
+
+def _parse_multi_insights(text: str, insight_types: list[str]) -> dict[str, str]:
+    """Validate the JSON object returned for a multi-insight prompt."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        if text.startswith("json"):
+            text = text[4:]
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    result = {}
+    for insight_type in insight_types:
+        value = data.get(insight_type)
+        if isinstance(value, list) and all(isinstance(item, str) for item in value):
+            value = "\n".join(f"- {item}" for item in value)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"missing or invalid field: {insight_type}")
+        result[insight_type] = value
+    return result
+
+async def chat_insights_multi(messages: list[str], insight_types: list[str]) -> dict[str, str]:
+    """Answer several insight types with one structured LLM call.
+
+    Falls back to one concurrent call per type if the response does not
+    parse into the expected JSON object.
+    """
+    if len(insight_types) == 1:
+        return {insight_types[0]: await chat_insights(messages, insight_types[0])}
+    fields = "\n".join(
+        f'- "{insight_type}": {INSIGHT_INSTRUCTIONS.get(insight_type, DEFAULT_INSIGHT_INSTRUCTION)}.'
+        for insight_type in insight_types
+    )
+    prompt = (
+        "Analyze the following conversation and respond with only a JSON object "
+        "whose keys are listed below and whose values are strings:\n"
+        f"{fields}\n\nConversation:\n" + "\n".join(messages)
+    )
+    try:
+        return _parse_multi_insights(await llm_client.generate(prompt), insight_types)
+    except ValueError:
+        results = await asyncio.gather(*(chat_insights(messages, t) for t in insight_types))
+        return dict(zip(insight_types, results))
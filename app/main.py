@@ -1,17 +1,102 @@
 import warnings
 warnings.filterwarnings("ignore", message="urllib3 v2 only supports OpenSSL 1.1.1+")
 
+import os
 from fastapi import FastAPI
-from app.database import get_db
-from app.routers import chat, user
-from app.crud import ensure_indexes
+from app.database import get_db, connect_to_mongodb, close_mongodb_connection, get_pool_stats
+from app.routers import chat, user, jobs, export
+from app.crud import ensure_indexes, verify_query_plans
+from app.ingest import write_behind, WRITE_BEHIND_ENABLED
+from app.cache import result_cache
+from app.llm import llm_client
+from app.singleflight import llm_flights
+from app.jobs import job_queue
+from app.auth import token_cache
+from app.metrics import MetricsMiddleware, metrics_response
+from app.realtime import conversation_hub
+from app.archive import archiver
+from app.admission import AdmissionMiddleware, admission
+from app.similarity import similarity_index
+
+VERIFY_QUERY_PLANS = os.getenv("VERIFY_QUERY_PLANS", "true").lower() in ("1", "true", "yes")
 
 app = FastAPI(title="Chat Summarization API")
+# Added first so it runs inside MetricsMiddleware and rejections are measured.
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 @app.on_event("startup")
 async def startup_db_client():
-    db = get_db()
-    await ensure_indexes(db)
+    await connect_to_mongodb()
+    await ensure_indexes(get_db())
+    await admission.start(get_db())
+    if VERIFY_QUERY_PLANS:
+        await verify_query_plans(get_db())
+    if WRITE_BEHIND_ENABLED:
+        write_behind.start(get_db())
+    await job_queue.start(get_db())
+    await conversation_hub.start(get_db())
+    archiver.start(get_db())
+    similarity_index.start(get_db())
+
+@app.on_event("shutdown")
+async def shutdown_db_client():
+    await similarity_index.stop()
+    await archiver.stop()
+    await conversation_hub.stop()
+    await job_queue.stop()
+    await write_behind.stop()
+    await close_mongodb_connection()
+
+@app.get("/metrics", tags=["stats"], include_in_schema=False)
+async def metrics():
+    return metrics_response()
+
+@app.get("/stats/pool", tags=["stats"])
+async def pool_stats():
+    return get_pool_stats()
+
+@app.get("/stats/ingest", tags=["stats"])
+async def ingest_stats():
+    return write_behind.stats()
+
+@app.get("/stats/cache", tags=["stats"])
+async def cache_stats():
+    return result_cache.stats()
+
+@app.get("/stats/llm", tags=["stats"])
+async def llm_stats():
+    return llm_client.stats()
+
+@app.get("/stats/singleflight", tags=["stats"])
+async def singleflight_stats():
+    return llm_flights.stats()
+
+@app.get("/stats/jobs", tags=["stats"])
+async def job_stats():
+    return job_queue.stats()
+
+@app.get("/stats/auth", tags=["stats"])
+async def auth_stats():
+    return token_cache.stats()
+
+@app.get("/stats/realtime", tags=["stats"])
+async def realtime_stats():
+    return conversation_hub.stats()
+
+@app.get("/stats/archive", tags=["stats"])
+async def archive_stats():
+    return archiver.stats()
+
+@app.get("/stats/admission", tags=["stats"])
+async def admission_stats():
+    return admission.stats()
+
+@app.get("/stats/similarity", tags=["stats"])
+async def similarity_stats():
+    return similarity_index.stats()
 
 app.include_router(chat.router, prefix="/chats", tags=["chats"])
-app.include_router(user.router, prefix="/users", tags=["users"]) 
\ No newline at end of file
+app.include_router(user.router, prefix="/users", tags=["users"])
+app.include_router(jobs.router, prefix="/jobs", tags=["jobs"])
+app.include_router(export.router, prefix="/exports", tags=["exports"])
@@ -0,0 +1,54 @@
+"""Maintenance commands.
+
+    python -m app.manage rebuild-conversations
+    python -m app.manage archive
+    python -m app.manage rebuild-similarity [--recount]
+"""
+import argparse
+import asyncio
+from app.database import connect_to_mongodb, close_mongodb_connection, get_db
+from app.crud import rebuild_conversation_aggregates
+from app.archive import archive_expired, RETENTION_DAYS
+from app.similarity import rebuild as rebuild_similarity_index, SIMILARITY_DIR
+
+
+async def rebuild_conversations(args):
+    count = await rebuild_conversation_aggregates(get_db())
+    print(f"Rebuilt {count} conversations")
+
+async def archive(args):
+    if RETENTION_DAYS <= 0:
+        print("RETENTION_DAYS is not set; nothing to archive")
+        return
+    count = await archive_expired(get_db())
+    if count is None:
+        print("Another process holds the archive lease; try again later")
+        return
+    print(f"Archived {count} messages older than {RETENTION_DAYS} days")
+
+async def rebuild_similarity(args):
+    count = await rebuild_similarity_index(get_db(), recount=args.recount)
+    print(f"Wrote {count} conversation vectors to {SIMILARITY_DIR}")
+
+COMMANDS = {
+    "rebuild-conversations": rebuild_conversations,
+    "archive": archive,
+    "rebuild-similarity": rebuild_similarity,
+}
+
+
+async def run(args):
+    await connect_to_mongodb()
+    try:
+        await COMMANDS[args.command](args)
+    finally:
+        await close_mongodb_connection()
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--recount", action="store_true", help="rebuild-similarity: recompute counts from chat_messages first")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
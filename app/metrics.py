@@ -0,0 +1,152 @@
+import contextvars
+import os
+import time
+import uuid
+from typing import Optional
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+from starlette.datastructures import MutableHeaders
+from starlette.responses import Response
+from starlette.routing import Match
+from dotenv import load_dotenv
+load_dotenv()
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being served", ["method", "route"])
+
+MONGO_COMMAND_DURATION = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ["command"], buckets=LATENCY_BUCKETS
+)
+MONGO_COMMAND_FAILURES = Counter("mongo_command_failures_total", "Failed MongoDB commands", ["command"])
+
+LLM_CALL_DURATION = Histogram(
+    "llm_call_duration_seconds", "LLM provider call latency", ["provider", "mode"], buckets=LATENCY_BUCKETS
+)
+LLM_QUEUE_DELAY = Histogram(
+    "llm_queue_delay_seconds", "Time waiting for the rate limiter and concurrency cap", ["provider"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_PROMPT_CHARS = Histogram("llm_prompt_chars", "Prompt size in characters", ["provider"], buckets=SIZE_BUCKETS)
+LLM_RESPONSE_CHARS = Histogram("llm_response_chars", "Response size in characters", ["provider"], buckets=SIZE_BUCKETS)
+LLM_ERRORS = Counter("llm_errors_total", "LLM calls that failed", ["provider", "error"])
+LLM_RETRIES = Counter("llm_retries_total", "LLM calls retried after a quota error", ["provider"])
+
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total", "Requests turned away by admission control", ["route_class", "reason"]
+)
+
+
+# Per-request trace: a list of (name, start, duration) spans. The list is
+# shared by reference, so spans recorded from executor threads that inherit
+# the context (as motor's do) land in the same trace.
+_current_trace: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("current_trace", default=None)
+
+
+def record_span(name: str, start: float, duration: float):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.append((name, start, duration))
+
+
+def _server_timing(trace: list) -> str:
+    totals = {}
+    for name, _, duration in trace:
+        count, total = totals.get(name, (0, 0.0))
+        totals[name] = (count + 1, total + duration)
+    return ", ".join(
+        f'{name.replace(" ", "_")};dur={total * 1000:.1f};desc="{count}x"' for name, (count, total) in totals.items()
+    )
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        duration = event.duration_micros / 1e6
+        MONGO_COMMAND_DURATION.labels(event.command_name).observe(duration)
+        record_span(f"mongo.{event.command_name}", time.perf_counter() - duration, duration)
+
+    def failed(self, event):
+        duration = event.duration_micros / 1e6
+        MONGO_COMMAND_DURATION.labels(event.command_name).observe(duration)
+        MONGO_COMMAND_FAILURES.labels(event.command_name).inc()
+        record_span(f"mongo.{event.command_name}", time.perf_counter() - duration, duration)
+
+
+command_metrics = CommandMetricsListener()
+
+
+def _route_template(scope) -> str:
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", scope["path"])
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Per-route latency and in-flight metrics, plus optional trace spans.
+
+    With TRACING_ENABLED, each response carries an X-Trace-Id and a
+    Server-Timing header aggregating the Mongo and LLM spans recorded
+    before the headers went out. Plain ASGI rather than BaseHTTPMiddleware,
+    so streamed responses are timed and counted in flight until their last
+    body chunk is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        route = _route_template(scope)
+        if route == "/metrics":
+            return await self.app(scope, receive, send)
+        method = scope["method"]
+        in_flight = HTTP_IN_FLIGHT.labels(method, route)
+        trace = [] if TRACING_ENABLED else None
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        status = 500
+        done = False
+
+        def finish():
+            nonlocal done
+            if not done:
+                done = True
+                in_flight.dec()
+                HTTP_REQUEST_DURATION.labels(method, route, str(status)).observe(time.perf_counter() - start)
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace is not None:
+                    headers = MutableHeaders(scope=message)
+                    headers["X-Trace-Id"] = uuid.uuid4().hex
+                    if trace:
+                        headers["Server-Timing"] = _server_timing(trace)
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            # Covers failures and client disconnects before the last chunk.
+            finish()
+            _current_trace.reset(token)
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,27 @@
+import base64
+import json
+from datetime import datetime
+from bson import ObjectId
+
+
+def encode_cursor(doc: dict) -> str:
+    """Opaque token for the (timestamp, _id) position of doc."""
+    _id = doc["_id"]
+    payload = {
+        "t": doc["timestamp"].isoformat(),
+        "i": str(_id),
+        "o": isinstance(_id, ObjectId),
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> tuple:
+    """Inverse of encode_cursor; raises ValueError for malformed tokens."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        timestamp = datetime.fromisoformat(payload["t"])
+        _id = ObjectId(payload["i"]) if payload.get("o") else payload["i"]
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    return timestamp, _id
@@ -0,0 +1,113 @@
+import math
+import os
+import re
+from collections import Counter
+from typing import Optional
+from app.llm import estimate_tokens
+from dotenv import load_dotenv
+load_dotenv()
+
+PROMPT_BUDGET_TOKENS = int(os.getenv("PROMPT_BUDGET_TOKENS", "8000"))
+PROMPT_BUDGET_STRATEGY = os.getenv("PROMPT_BUDGET_STRATEGY", "recent")
+PROMPT_MIN_MESSAGE_CHARS = int(os.getenv("PROMPT_MIN_MESSAGE_CHARS", "2"))
+# Upper bound on one merged same-speaker line, so single-speaker
+# conversations still split into chunks and fit token budgets.
+PROMPT_MERGE_MAX_TOKENS = int(os.getenv("PROMPT_MERGE_MAX_TOKENS", "256"))
+
+# Per-insight-type overrides, e.g. PROMPT_BUDGET_SENTIMENT=2000.
+INSIGHT_BUDGETS = {
+    insight_type: int(os.getenv(f"PROMPT_BUDGET_{insight_type.upper()}", PROMPT_BUDGET_TOKENS))
+    for insight_type in ("sentiment", "keywords", "actions", "highlights")
+}
+
+# Greetings and acknowledgements only. Yes/no replies answer a question and are kept.
+BOILERPLATE = {
+    "ok", "okay", "k", "kk", "thanks", "thank you", "thx", "ty", "np", "lol", "haha",
+    "hi", "hello", "hey", "bye", "+1",
+}
+
+_WORD = re.compile(r"\w+")
+_SPACE = re.compile(r"\s+")
+
+
+def insight_budget(insight_type: str) -> int:
+    return INSIGHT_BUDGETS.get(insight_type, PROMPT_BUDGET_TOKENS)
+
+
+def _normalize(text: str) -> str:
+    return _SPACE.sub(" ", text).strip()
+
+
+def _is_noise(text: str) -> bool:
+    if len(text) < PROMPT_MIN_MESSAGE_CHARS:
+        return True
+    return text.lower().strip(" .!?,") in BOILERPLATE
+
+
+def _salience(lines: list[tuple[str, str]]) -> list[float]:
+    """Sum of inverse document frequency of each message's distinct terms."""
+    terms = [set(_WORD.findall(text.lower())) for _, text in lines]
+    df = Counter(term for message_terms in terms for term in message_terms)
+    n = len(lines)
+    return [sum(math.log((n + 1) / (df[t] + 0.5)) for t in message_terms) for message_terms in terms]
+
+
+def _truncate(speaker: str, text: str, budget_tokens: int) -> str:
+    """Keep the end of an over-budget line, which holds its newest text."""
+    chars = max(0, (budget_tokens - estimate_tokens(f"{speaker}: ...")) * 4)
+    return f"{speaker}: ...{text[len(text) - chars:]}" if chars else ""
+
+
+def compact_messages(messages: list[dict], budget_tokens: Optional[int] = None, strategy: str = PROMPT_BUDGET_STRATEGY) -> list[str]:
+    """Turn stored messages into compact, speaker-tagged prompt lines.
+
+    Whitespace is collapsed, empty and boilerplate messages and exact
+    duplicates are dropped, and consecutive messages from the same speaker
+    are merged onto one ``user_id: text`` line of at most
+    PROMPT_MERGE_MAX_TOKENS (or the budget, if smaller). With a token
+    budget, either the most recent lines (``recent``) or the
+    highest-salience lines (``salient``) are kept, in conversation order;
+    if not even one line fits, the tail of the newest line is returned.
+    """
+    merge_tokens = PROMPT_MERGE_MAX_TOKENS if budget_tokens is None else min(PROMPT_MERGE_MAX_TOKENS, budget_tokens)
+    seen = set()
+    lines: list[tuple[str, str]] = []
+    for msg in messages:
+        text = _normalize(str(msg.get("message", "")))
+        speaker = str(msg.get("user_id", "?"))
+        if _is_noise(text):
+            continue
+        key = (speaker, text.lower())
+        if key in seen:
+            continue
+        seen.add(key)
+        merged = f"{lines[-1][1]} / {text}" if lines and lines[-1][0] == speaker else None
+        if merged is not None and estimate_tokens(f"{speaker}: {merged}") <= merge_tokens:
+            lines[-1] = (speaker, merged)
+        else:
+            lines.append((speaker, text))
+
+    rendered = [f"{speaker}: {text}" for speaker, text in lines]
+    if budget_tokens is None:
+        return rendered
+    costs = [estimate_tokens(line) for line in rendered]
+    if sum(costs) <= budget_tokens:
+        return rendered
+
+    kept, used = [], 0
+    if strategy == "salient":
+        scores = _salience(lines)
+        for i in sorted(range(len(rendered)), key=lambda i: scores[i], reverse=True):
+            if used + costs[i] <= budget_tokens:
+                kept.append(i)
+                used += costs[i]
+    else:
+        for i in range(len(rendered) - 1, -1, -1):
+            if used + costs[i] > budget_tokens:
+                break
+            kept.append(i)
+            used += costs[i]
+    if not kept:
+        truncated = _truncate(*lines[-1], budget_tokens)
+        return [truncated] if truncated else []
+    return [rendered[i] for i in sorted(kept)]
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+from pymongo.errors import PyMongoError
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REALTIME_QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", "1000"))
+REALTIME_CHANGE_STREAMS = os.getenv("REALTIME_CHANGE_STREAMS", "true").lower() in ("1", "true", "yes")
+
+# Queued in place of a subscriber's backlog once it falls behind.
+OVERFLOW = object()
+
+
+class ConversationHub:
+    """Fans newly inserted messages out to per-conversation subscribers.
+
+    When the deployment supports change streams, a watcher task feeds the
+    hub from Mongo so inserts made by any node are delivered. Otherwise the
+    hub is fed in-process from crud, which only covers this node.
+    """
+
+    def __init__(self, queue_size: int = REALTIME_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._watcher: Optional[asyncio.Task] = None
+        self.change_streams = False
+        self.published = 0
+        self.overflowed = 0
+
+    def subscribe(self, conversation_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(conversation_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, conversation_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(conversation_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[conversation_id]
+
+    def _publish(self, doc: dict):
+        queues = self._subscribers.get(doc["conversation_id"])
+        for queue in tuple(queues or ()):
+            if queue.full():
+                # Slow consumer: rather than skip messages, replace its backlog
+                # with OVERFLOW so the socket is closed and the client resumes
+                # from its last cursor. It receives nothing further.
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(OVERFLOW)
+                self.unsubscribe(doc["conversation_id"], queue)
+                self.overflowed += 1
+                continue
+            queue.put_nowait(doc)
+        self.published += 1
+
+    def publish_local(self, documents: list[dict]):
+        """Called by crud after inserts; a no-op when change streams feed the hub."""
+        if self.change_streams:
+            return
+        for doc in documents:
+            if doc["conversation_id"] in self._subscribers:
+                self._publish(doc)
+
+    async def start(self, db):
+        if not REALTIME_CHANGE_STREAMS or self._watcher is not None:
+            return
+        try:
+            stream = db.chat_messages.watch([{"$match": {"operationType": "insert"}}])
+            # The stream opens lazily; this fails fast on standalone servers.
+            change = await stream.try_next()
+        except Exception as e:
+            # Standalone servers and test doubles without change stream support.
+            logger.info("Change streams unavailable, using in-process fanout: %s", e)
+            return
+        self.change_streams = True
+        if change is not None and change.get("fullDocument") is not None:
+            self._publish(change["fullDocument"])
+        self._watcher = asyncio.create_task(self._watch(stream))
+
+    async def _watch(self, stream):
+        try:
+            async with stream:
+                async for change in stream:
+                    doc = change.get("fullDocument")
+                    if doc is not None:
+                        self._publish(doc)
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            logger.warning("Change stream stopped, falling back to in-process fanout: %s", e)
+        finally:
+            self.change_streams = False
+            self._watcher = None
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "source": "change_stream" if self.change_streams else "in_process",
+            "conversations": len(self._subscribers),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "published": self.published,
+            "overflowed": self.overflowed,
+        }
+
+
+conversation_hub = ConversationHub()
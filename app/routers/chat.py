@@ -1,12 +1,30 @@
-from fastapi import APIRouter, HTTPException, Body, Depends, Query, status
+from fastapi import APIRouter, HTTPException, Body, Depends, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from app.schemas import ChatMessageCreate, ChatMessageResponse
-from app.crud import insert_chat_message, get_chat_messages, delete_chat_messages
-from app.llm import summarize_chat, chat_insights
+from app.crud import (
+    insert_chat_message, get_chat_messages, get_chat_messages_after, iter_chat_messages, count_chat_messages,
+    delete_chat_messages, MESSAGE_PROJECTION, CHAT_DELETE_BATCH_SIZE,
+)
+from app.services import (
+    summarize_conversation, conversation_insights, open_summary_stream, open_insight_stream,
+    summarize_conversation_fast, conversation_insights_fast, ConversationNotFound,
+    FAST_MODE_FALLBACK, LLM_FALLBACK_ERRORS,
+)
+from app.extractive import FAST_INSIGHT_TYPES
 from app.database import get_db
+from app.auth import token_cache
+from app.ingest import ingest_rows, iter_json_array, iter_ndjson, write_behind
+from app.serialization import dumps, FastJSONResponse
+from app.pagination import encode_cursor, decode_cursor
+from app.realtime import OVERFLOW, conversation_hub
+from app.jobs import job_queue, QueueFull
+from app.similarity import similarity_index
 from datetime import datetime
 from typing import Optional, List
+import asyncio
+import json
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -18,11 +36,15 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 router = APIRouter()
 
 def get_current_user(token: str = Depends(oauth2_scheme)):
+    username = token_cache.get(token)
+    if username is not None:
+        return username
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        token_cache.put(token, username, payload.get("exp"))
         return username
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
@@ -30,60 +52,282 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
 @router.post("/", response_model=dict)
 async def store_chat_message(chat: ChatMessageCreate, db=Depends(get_db), user=Depends(get_current_user)):
     try:
-        await insert_chat_message(chat, db)
+        if write_behind.running:
+            await write_behind.submit(chat)
+        else:
+            await insert_chat_message(chat, db)
         return {"message": "Chat stored successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/bulk", response_model=dict)
+async def store_chat_messages_bulk(request: Request, db=Depends(get_db), user=Depends(get_current_user)):
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        rows = iter_ndjson(request.stream())
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        if not isinstance(body, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        rows = iter_json_array(body)
+    result = await ingest_rows(rows, db)
+    return result.as_dict()
+
 @router.get("/{conversation_id}", response_model=list[ChatMessageResponse])
 async def retrieve_chat_messages(
     conversation_id: str,
+    request: Request,
     db=Depends(get_db),
     user=Depends(get_current_user),
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
-    keywords: Optional[str] = Query(None)
+    keywords: Optional[str] = Query(None),
+    format: Optional[str] = Query(None, description="Set to 'ndjson' to stream one message per line"),
+    since: Optional[str] = Query(None, description="X-Next-Cursor from an earlier response; only newer messages are returned")
 ):
     keyword_list = keywords.split(",") if keywords else None
-    messages = await get_chat_messages(conversation_id, db, start_date, end_date, keyword_list)
+    if since:
+        try:
+            after = decode_cursor(since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid since cursor")
+        messages = await get_chat_messages_after(conversation_id, db, *after, projection=CURSOR_PROJECTION)
+        return _messages_with_cursor(messages, since)
+    if format == "ndjson" or "application/x-ndjson" in request.headers.get("accept", ""):
+        rows = iter_chat_messages(conversation_id, db, start_date, end_date, keyword_list)
+        try:
+            first = await rows.__anext__()
+        except StopAsyncIteration:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+
+        async def lines():
+            yield dumps(first) + b"\n"
+            async for row in rows:
+                yield dumps(row) + b"\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+    messages = await get_chat_messages(conversation_id, db, start_date, end_date, keyword_list, CURSOR_PROJECTION)
     if not messages:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    for msg in messages:
-        msg.pop('_id', None)
-        # Ensure timestamp exists and is a datetime object
-        if 'timestamp' not in msg or msg['timestamp'] is None:
-            msg['timestamp'] = datetime.utcnow()
-        elif not isinstance(msg['timestamp'], datetime):
-            try:
-                msg['timestamp'] = datetime.fromisoformat(msg['timestamp'])
-            except Exception:
-                msg['timestamp'] = datetime.utcnow()
-    return messages
+    return _messages_with_cursor(messages, None)
+
+CURSOR_PROJECTION = {**MESSAGE_PROJECTION, "_id": 1}
+
+def _messages_with_cursor(messages: list, since: Optional[str]) -> FastJSONResponse:
+    """Messages without _id, plus an X-Next-Cursor for fetching what arrives later."""
+    cursor = encode_cursor(messages[-1]) if messages else since
+    for message in messages:
+        del message["_id"]
+    # Documents are projected and normalized at write time, so they already
+    # match ChatMessageResponse and can skip re-validation.
+    return FastJSONResponse(messages, headers={"X-Next-Cursor": cursor} if cursor else None)
 
 @router.post("/summarize", response_model=dict)
-async def summarize_chat_messages(conversation_id: str = Body(..., embed=True), db=Depends(get_db), user=Depends(get_current_user)):
-    messages = await get_chat_messages(conversation_id, db)
-    if not messages:
+async def summarize_chat_messages(
+    conversation_id: str = Body(..., embed=True),
+    rebuild: bool = Body(False, embed=True),
+    mode: str = Body("llm", embed=True),
+    db=Depends(get_db),
+    user=Depends(get_current_user)
+):
+    if mode not in ("llm", "fast"):
+        raise HTTPException(status_code=422, detail="mode must be 'llm' or 'fast'")
+    try:
+        if mode == "fast":
+            return {"summary": await summarize_conversation_fast(conversation_id, db), "mode": "fast"}
+        try:
+            summary = await summarize_conversation(conversation_id, db, rebuild)
+        except LLM_FALLBACK_ERRORS:
+            if not FAST_MODE_FALLBACK:
+                raise HTTPException(status_code=503, detail="Summarization backend unavailable")
+            return {"summary": await summarize_conversation_fast(conversation_id, db), "mode": "fast", "degraded": True}
+    except ConversationNotFound:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    message_texts = [msg["message"] for msg in messages]
-    summary = await summarize_chat(message_texts)
     return {"summary": summary}
 
+def _sse_response(request: Request, chunks, result_field: str):
+    async def events():
+        parts = []
+        try:
+            async for chunk in chunks:
+                if await request.is_disconnected():
+                    break
+                parts.append(chunk)
+                yield f"data: {json.dumps({'delta': chunk})}\n\n"
+            else:
+                yield f"event: done\ndata: {json.dumps({result_field: ''.join(parts)})}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+        finally:
+            # Closing the generator cancels the upstream LLM stream.
+            await chunks.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.post("/summarize/stream")
+async def summarize_chat_messages_stream(
+    request: Request,
+    conversation_id: str = Body(..., embed=True),
+    rebuild: bool = Body(False, embed=True),
+    db=Depends(get_db),
+    user=Depends(get_current_user)
+):
+    try:
+        chunks = await open_summary_stream(conversation_id, db, rebuild)
+    except ConversationNotFound:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return _sse_response(request, chunks, "summary")
+
+@router.post("/insights/stream")
+async def chat_insights_stream(
+    request: Request,
+    conversation_id: str = Body(..., embed=True),
+    insight_type: str = Body(..., embed=True),
+    db=Depends(get_db),
+    user=Depends(get_current_user)
+):
+    try:
+        chunks = await open_insight_stream(conversation_id, insight_type, db)
+    except ConversationNotFound:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return _sse_response(request, chunks, "insight")
+
+@router.get("/{conversation_id}/similar", response_model=dict)
+async def similar_conversations(
+    conversation_id: str,
+    k: int = Query(10, ge=1, le=100),
+    db=Depends(get_db),
+    user=Depends(get_current_user)
+):
+    similar = await similarity_index.similar(conversation_id, db, k)
+    if similar is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"conversation_id": conversation_id, "similar": similar}
+
 @router.delete("/{conversation_id}", response_model=dict)
-async def delete_chat(conversation_id: str, db=Depends(get_db), user=Depends(get_current_user)):
+async def delete_chat(conversation_id: str, response: Response, db=Depends(get_db), user=Depends(get_current_user)):
+    # Conversations larger than one delete batch are removed by a background job.
+    if await count_chat_messages(conversation_id, db, limit=CHAT_DELETE_BATCH_SIZE + 1) > CHAT_DELETE_BATCH_SIZE:
+        try:
+            job_id = await job_queue.enqueue("delete", {"conversation_id": conversation_id}, priority=9)
+        except QueueFull:
+            raise HTTPException(status_code=503, detail="Job queue is full", headers={"Retry-After": "5"})
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {"message": "Chat deletion scheduled", "job_id": job_id}
     await delete_chat_messages(conversation_id, db)
     return {"message": "Chat deleted successfully"}
 
 @router.post("/insights", response_model=dict)
 async def chat_insights_endpoint(
     conversation_id: str = Body(..., embed=True),
-    insight_type: str = Body(..., embed=True),
+    insight_type: Optional[str] = Body(None, embed=True),
+    insight_types: Optional[List[str]] = Body(None, embed=True),
+    mode: str = Body("llm", embed=True),
     db=Depends(get_db),
     user=Depends(get_current_user)
 ):
-    messages = await get_chat_messages(conversation_id, db)
-    if not messages:
+    if not insight_type and not insight_types:
+        raise HTTPException(status_code=422, detail="insight_type or insight_types is required")
+    if mode not in ("llm", "fast"):
+        raise HTTPException(status_code=422, detail="mode must be 'llm' or 'fast'")
+    requested = insight_types or [insight_type]
+    fast_capable = all(kind in FAST_INSIGHT_TYPES for kind in requested)
+    if mode == "fast" and not fast_capable:
+        raise HTTPException(status_code=422, detail=f"Fast mode supports only: {', '.join(FAST_INSIGHT_TYPES)}")
+    extra = {}
+    try:
+        if mode == "fast":
+            insights = await conversation_insights_fast(conversation_id, requested, db)
+            extra = {"mode": "fast"}
+        else:
+            try:
+                insights = await conversation_insights(conversation_id, requested, db)
+            except LLM_FALLBACK_ERRORS:
+                if not (FAST_MODE_FALLBACK and fast_capable):
+                    raise HTTPException(status_code=503, detail="Insights backend unavailable")
+                insights = await conversation_insights_fast(conversation_id, requested, db)
+                extra = {"mode": "fast", "degraded": True}
+    except ConversationNotFound:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    message_texts = [msg["message"] for msg in messages]
-    insight = await chat_insights(message_texts, insight_type)
-    return {"insight": insight} 
\ No newline at end of file
+    if insight_types is None:
+        return {"insight": insights[insight_type], **extra}
+    return {"insights": insights, **extra}
+
+def _update_payload(doc: dict) -> str:
+    return dumps({
+        "conversation_id": doc["conversation_id"],
+        "user_id": doc["user_id"],
+        "message": doc["message"],
+        "timestamp": doc["timestamp"],
+        "cursor": encode_cursor(doc),
+    }).decode()
+
+@router.websocket("/{conversation_id}/ws")
+async def conversation_updates(
+    websocket: WebSocket,
+    conversation_id: str,
+    token: str = Query(...),
+    since: Optional[str] = Query(None, description="Cursor of the last message seen, to resume after a reconnect"),
+    db=Depends(get_db)
+):
+    """Push messages inserted into a conversation as they arrive.
+
+    Each event carries a ``cursor``; reconnecting with ``since=<cursor>``
+    first replays everything inserted after it, then continues live. A
+    client that falls ``REALTIME_QUEUE_SIZE`` messages behind is closed with
+    1013 so that it reconnects that way instead of missing messages.
+    """
+    try:
+        get_current_user(token)
+        after = decode_cursor(since) if since else None
+    except (HTTPException, ValueError):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    # Subscribe before replaying so nothing inserted in between is missed.
+    queue = conversation_hub.subscribe(conversation_id)
+    receiver = asyncio.create_task(_drain_client(websocket))
+    try:
+        last = after
+        if after is not None:
+            for doc in await get_chat_messages_after(conversation_id, db, *after):
+                await websocket.send_text(_update_payload(doc))
+                last = (doc["timestamp"], doc["_id"])
+        while True:
+            getter = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                getter.cancel()
+                break
+            doc = getter.result()
+            if doc is OVERFLOW:
+                await websocket.close(
+                    code=status.WS_1013_TRY_AGAIN_LATER,
+                    reason="Subscriber fell behind; reconnect with since=<last cursor>",
+                )
+                break
+            position = (doc["timestamp"], doc["_id"])
+            if last is not None and position <= last:
+                continue
+            await websocket.send_text(_update_payload(doc))
+            last = position
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        conversation_hub.unsubscribe(conversation_id, queue)
+
+async def _drain_client(websocket: WebSocket):
+    # Clients only listen; reading lets us notice disconnects promptly.
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
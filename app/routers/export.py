@@ -0,0 +1,80 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
+from bson import ObjectId
+from app.crud import iter_message_batches, get_message_position
+from app.database import get_db
+from app.export import EXPORT_FORMATS, ARROW_FORMATS, EXPORT_BATCH_SIZE, arrow_available, arrow_stream, ndjson_stream
+from app.routers.chat import get_current_user
+from app.pagination import decode_cursor
+from datetime import datetime
+from typing import Optional
+import re
+
+router = APIRouter()
+
+FORMAT_PATTERN = "^(" + "|".join(f.replace(".", r"\.") for f in EXPORT_FORMATS) + ")$"
+
+async def _export(db, name: str, fmt: str, after: Optional[str], **filters) -> StreamingResponse:
+    if fmt in ARROW_FORMATS and not arrow_available():
+        raise HTTPException(status_code=501, detail=f"{fmt} export requires pyarrow")
+    position = None
+    if after:
+        try:
+            position = decode_cursor(after)
+        except ValueError:
+            # Older clients resume with a bare _id, which only works while that row is still hot.
+            if not ObjectId.is_valid(after):
+                raise HTTPException(status_code=400, detail="Invalid after cursor")
+            position = await get_message_position(ObjectId(after), db)
+            if position is None:
+                raise HTTPException(status_code=400, detail="Unknown after id; resume with the last row's cursor")
+    batches = iter_message_batches(db, after=position, batch_size=EXPORT_BATCH_SIZE, **filters)
+    if fmt in ARROW_FORMATS:
+        body = arrow_stream(batches, fmt)
+    else:
+        body = ndjson_stream(batches, compress=fmt == "ndjson.gz")
+    media_type, extension = EXPORT_FORMATS[fmt]
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{re.sub(r"[^A-Za-z0-9._-]", "_", name)}.{extension}"'},
+    )
+
+@router.get("/conversations/{conversation_id}")
+async def export_conversation(
+    conversation_id: str,
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    after: Optional[str] = Query(None, description="cursor of the last row already received, to resume"),
+    format: str = Query("ndjson.gz", pattern=FORMAT_PATTERN),
+    db=Depends(get_db),
+    user=Depends(get_current_user)
+):
+    return await _export(
+        db, f"conversation-{conversation_id}", format, after,
+        conversation_id=conversation_id, start_date=start_date, end_date=end_date,
+    )
+
+@router.get("/users/{user_id}")
+async def export_user(
+    user_id: str,
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    after: Optional[str] = Query(None, description="cursor of the last row already received, to resume"),
+    format: str = Query("ndjson.gz", pattern=FORMAT_PATTERN),
+    db=Depends(get_db),
+    user=Depends(get_current_user)
+):
+    return await _export(db, f"user-{user_id}", format, after, user_id=user_id, start_date=start_date, end_date=end_date)
+
+@router.get("/messages")
+async def export_messages(
+    start_date: datetime = Query(...),
+    end_date: datetime = Query(...),
+    after: Optional[str] = Query(None, description="cursor of the last row already received, to resume"),
+    format: str = Query("ndjson.gz", pattern=FORMAT_PATTERN),
+    db=Depends(get_db),
+    user=Depends(get_current_user)
+):
+    name = f"messages-{start_date:%Y%m%d}-{end_date:%Y%m%d}"
+    return await _export(db, name, format, after, start_date=start_date, end_date=end_date)
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, HTTPException, Depends
+from app.schemas import JobCreate
+from app.jobs import job_queue, QueueFull
+from app.routers.chat import get_current_user
+
+router = APIRouter()
+
+@router.post("/", response_model=dict, status_code=202)
+async def create_job(job: JobCreate, user=Depends(get_current_user)):
+    if job.type == "summarize":
+        params = {"conversation_id": job.conversation_id, "rebuild": job.rebuild}
+    elif job.type == "insights":
+        if not job.insight_types:
+            raise HTTPException(status_code=422, detail="insight_types is required for insights jobs")
+        params = {"conversation_id": job.conversation_id, "insight_types": job.insight_types}
+    else:
+        raise HTTPException(status_code=422, detail="type must be 'summarize' or 'insights'")
+    try:
+        job_id = await job_queue.enqueue(job.type, params, job.priority)
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="Job queue is full", headers={"Retry-After": "5"})
+    return {"job_id": job_id, "status": "queued"}
+
+@router.get("/{job_id}", response_model=dict)
+async def get_job(job_id: str, user=Depends(get_current_user)):
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job["job_id"] = job.pop("_id")
+    return job
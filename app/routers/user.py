@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
-from app.crud import get_user_chats, create_user, get_user_by_username, verify_password
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from app.crud import get_user_chats, get_user_conversations, search_user_messages, build_text_search, create_user, get_user_by_username, verify_password_async
 from app.database import get_db
+from app.pagination import encode_cursor, decode_cursor
+from app.routers.chat import get_current_user
 from app.schemas import UserCreate, UserLogin
 from datetime import datetime, timedelta
 from typing import Optional, List
@@ -26,7 +28,7 @@ async def register(user: UserCreate, db=Depends(get_db)):
 @router.post("/auth/login")
 async def login(user: UserLogin, db=Depends(get_db)):
     db_user = await get_user_by_username(user.username, db)
-    if not db_user or not verify_password(user.password, db_user["hashed_password"]):
+    if not db_user or not await verify_password_async(user.password, db_user["hashed_password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token_data = {
         "sub": user.username,
@@ -38,18 +40,30 @@ async def login(user: UserLogin, db=Depends(get_db)):
 @router.get("/users/{user_id}/chats", response_model=list)
 async def get_user_chat_history(
     user_id: str,
+    response: Response,
     page: int = 1,
     limit: int = 10,
+    cursor: Optional[str] = Query(None),
     db=Depends(get_db),
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     keywords: Optional[str] = Query(None)
 ):
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
     skip = (page - 1) * limit
     keyword_list = keywords.split(",") if keywords else None
-    chats = await get_user_chats(user_id, skip, limit, db, start_date, end_date, keyword_list)
-    if not chats:
+    # One extra row tells whether another page exists.
+    chats = await get_user_chats(user_id, skip, limit + 1, db, start_date, end_date, keyword_list, after)
+    if not chats and after is None:
         raise HTTPException(status_code=404, detail="No chats found for this user")
+    if len(chats) > limit:
+        chats = chats[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(chats[-1])
     for chat in chats:
         chat.pop('_id', None)
         # Ensure timestamp exists and is a datetime object
@@ -60,4 +74,48 @@ async def get_user_chat_history(
                 chat['timestamp'] = datetime.fromisoformat(chat['timestamp'])
             except Exception:
                 chat['timestamp'] = datetime.utcnow()
-    return chats 
\ No newline at end of file
+    return chats 
+
+@router.get("/users/{user_id}/search", response_model=list)
+async def search_user_chats(
+    user_id: str,
+    q: Optional[str] = Query(None, description="Comma-separated keywords; any may match"),
+    phrase: Optional[List[str]] = Query(None, description="Exact phrase that must appear; repeatable"),
+    conversation_id: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=200),
+    db=Depends(get_db),
+    user=Depends(get_current_user)
+):
+    keyword_list = q.split(",") if q else None
+    if not build_text_search(keyword_list, phrase):
+        raise HTTPException(status_code=400, detail="Provide q or phrase")
+    return await search_user_messages(user_id, db, keyword_list, phrase, conversation_id, limit)
+
+@router.get("/{user_id}/conversations", response_model=list)
+async def list_user_conversations(
+    user_id: str,
+    limit: int = Query(20, ge=1, le=200),
+    before: Optional[datetime] = Query(None, description="Only conversations last active before this time"),
+    db=Depends(get_db),
+    user=Depends(get_current_user)
+):
+    conversations = await get_user_conversations(user_id, db, limit, before)
+    result = []
+    for conv in conversations:
+        summarized = conv.get("summary_message_count")
+        if summarized is None:
+            summary_status = "none"
+        elif summarized >= conv["message_count"]:
+            summary_status = "current"
+        else:
+            summary_status = "stale"
+        result.append({
+            "conversation_id": conv["_id"],
+            "message_count": conv["message_count"],
+            "first_activity": conv["first_activity"],
+            "last_activity": conv["last_activity"],
+            "participants": conv.get("participants", []),
+            "summary_status": summary_status,
+            "summarized_at": conv.get("summarized_at"),
+        })
+    return result
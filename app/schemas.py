@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
+from typing import Optional, List
 
 class ChatMessageCreate(BaseModel):
     conversation_id: str
@@ -18,4 +19,11 @@ class UserCreate(BaseModel):
 
 class UserLogin(BaseModel):
     username: str
-    password: str 
\ No newline at end of file
+    password: str
+
+class JobCreate(BaseModel):
+    type: str
+    conversation_id: str
+    insight_types: Optional[List[str]] = None
+    rebuild: bool = False
+    priority: int = 5
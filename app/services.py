@@ -0,0 +1,205 @@
+from app.crud import (
+    get_chat_messages, get_chat_messages_after, get_summary_checkpoint, save_summary_checkpoint,
+    get_conversation_message_count,
+)
+import asyncio
+import os
+from typing import AsyncIterator
+from app.llm import (
+    summarize_chat, summarize_chat_chunked, refine_summary, chat_insights_multi,
+    summary_prompt, refine_prompt, insight_prompt, llm_client, LLMRateLimitError, LLMUnavailableError,
+    estimate_messages_tokens, MODEL_NAME, SUMMARY_CHUNK_THRESHOLD_TOKENS,
+)
+from app.cache import result_cache, messages_digest
+from app.prompting import compact_messages, insight_budget
+from app.singleflight import llm_flights
+from app.extractive import fast_summary, fast_insight
+
+FAST_MODE_FALLBACK = os.getenv("FAST_MODE_FALLBACK", "true").lower() in ("1", "true", "yes")
+
+# Errors after which a request may be answered by the local extractive engine.
+LLM_FALLBACK_ERRORS = (LLMRateLimitError, LLMUnavailableError, asyncio.TimeoutError)
+
+
+class ConversationNotFound(Exception):
+    pass
+
+
+async def _summarize_texts(message_texts):
+    if estimate_messages_tokens(message_texts) > SUMMARY_CHUNK_THRESHOLD_TOKENS:
+        return await summarize_chat_chunked(message_texts)
+    return await summarize_chat(message_texts)
+
+def _last_message(messages):
+    return max(messages, key=lambda msg: (msg["timestamp"], msg["_id"]))
+
+async def _messages_since_checkpoint(conversation_id: str, checkpoint: dict, db):
+    """Messages after the checkpoint, or None when it no longer covers everything before them.
+
+    A message can land behind the checkpoint's position (an explicit older
+    timestamp, clock skew between nodes). The live count is read first, so
+    inserts racing with the fetch can only make the expected total larger.
+    """
+    live_count = await get_conversation_message_count(conversation_id, db)
+    new_messages = await get_chat_messages_after(
+        conversation_id, db, checkpoint["last_timestamp"], checkpoint["last_id"]
+    )
+    if live_count is not None and checkpoint["message_count"] + len(new_messages) < live_count:
+        return None
+    return new_messages
+
+async def summarize_conversation(conversation_id: str, db, rebuild: bool = False) -> str:
+    checkpoint = None if rebuild else await get_summary_checkpoint(conversation_id, db)
+    new_messages = None
+    if checkpoint is not None and checkpoint.get("model") == MODEL_NAME:
+        new_messages = await _messages_since_checkpoint(conversation_id, checkpoint, db)
+    if new_messages is not None:
+        if not new_messages:
+            return checkpoint["summary"]
+
+        async def refine():
+            new_texts = compact_messages(new_messages)
+            if estimate_messages_tokens(new_texts) > SUMMARY_CHUNK_THRESHOLD_TOKENS:
+                new_texts = [await summarize_chat_chunked(new_texts)]
+            summary = await refine_summary(checkpoint["summary"], new_texts)
+            await save_summary_checkpoint(
+                conversation_id, summary, new_messages[-1],
+                checkpoint["message_count"] + len(new_messages), MODEL_NAME, db
+            )
+            return summary
+
+        key = ("summary-refine", conversation_id, str(checkpoint["last_id"]), messages_digest(new_messages))
+        return await llm_flights.do(key, refine)
+
+    messages = await get_chat_messages(conversation_id, db)
+    if not messages:
+        raise ConversationNotFound(conversation_id)
+    digest = messages_digest(messages)
+    summary = None if rebuild else await result_cache.get(db, conversation_id, digest, "summary", MODEL_NAME)
+    if summary is None:
+        async def summarize():
+            result = await _summarize_texts(compact_messages(messages))
+            await result_cache.set(db, conversation_id, digest, "summary", MODEL_NAME, result)
+            return result
+
+        summary = await llm_flights.do(("summary", digest), summarize)
+    await save_summary_checkpoint(conversation_id, summary, _last_message(messages), len(messages), MODEL_NAME, db)
+    return summary
+
+async def conversation_insights(conversation_id: str, insight_types: list[str], db) -> dict[str, str]:
+    requested = list(dict.fromkeys(insight_types))
+    messages = await get_chat_messages(conversation_id, db)
+    if not messages:
+        raise ConversationNotFound(conversation_id)
+    digest = messages_digest(messages)
+    insights = {}
+    for kind in requested:
+        cached = await result_cache.get(db, conversation_id, digest, f"insight:{kind}", MODEL_NAME)
+        if cached is not None:
+            insights[kind] = cached
+    missing = [kind for kind in requested if kind not in insights]
+    if missing:
+        async def generate():
+            budget = max(insight_budget(kind) for kind in missing)
+            generated = await chat_insights_multi(compact_messages(messages, budget), missing)
+            for kind, value in generated.items():
+                await result_cache.set(db, conversation_id, digest, f"insight:{kind}", MODEL_NAME, value)
+            return generated
+
+        insights.update(await llm_flights.do(("insights", digest, tuple(missing)), generate))
+    return {kind: insights[kind] for kind in requested}
+
+async def _single(text: str) -> AsyncIterator[str]:
+    yield text
+
+async def open_summary_stream(conversation_id: str, db, rebuild: bool = False) -> AsyncIterator[str]:
+    """Resolve the conversation and return an iterator of summary chunks.
+
+    Lookups happen up front so a missing conversation raises
+    ConversationNotFound before any output is sent. The cache and checkpoint
+    are only updated once the stream has been fully consumed.
+    """
+    checkpoint = None if rebuild else await get_summary_checkpoint(conversation_id, db)
+    new_messages = None
+    if checkpoint is not None and checkpoint.get("model") == MODEL_NAME:
+        new_messages = await _messages_since_checkpoint(conversation_id, checkpoint, db)
+    if new_messages is not None:
+        if not new_messages:
+            return _single(checkpoint["summary"])
+
+        async def refine():
+            new_texts = compact_messages(new_messages)
+            if estimate_messages_tokens(new_texts) > SUMMARY_CHUNK_THRESHOLD_TOKENS:
+                new_texts = [await summarize_chat_chunked(new_texts)]
+            parts = []
+            async for chunk in llm_client.stream(refine_prompt(checkpoint["summary"], new_texts)):
+                parts.append(chunk)
+                yield chunk
+            await save_summary_checkpoint(
+                conversation_id, "".join(parts), new_messages[-1],
+                checkpoint["message_count"] + len(new_messages), MODEL_NAME, db
+            )
+
+        return refine()
+
+    messages = await get_chat_messages(conversation_id, db)
+    if not messages:
+        raise ConversationNotFound(conversation_id)
+    digest = messages_digest(messages)
+    cached = None if rebuild else await result_cache.get(db, conversation_id, digest, "summary", MODEL_NAME)
+    if cached is not None:
+        await save_summary_checkpoint(conversation_id, cached, _last_message(messages), len(messages), MODEL_NAME, db)
+        return _single(cached)
+
+    async def summarize():
+        message_texts = compact_messages(messages)
+        if estimate_messages_tokens(message_texts) > SUMMARY_CHUNK_THRESHOLD_TOKENS:
+            chunks = _single(await summarize_chat_chunked(message_texts))
+        else:
+            chunks = llm_client.stream(summary_prompt(message_texts))
+        parts = []
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        summary = "".join(parts)
+        await result_cache.set(db, conversation_id, digest, "summary", MODEL_NAME, summary)
+        await save_summary_checkpoint(conversation_id, summary, _last_message(messages), len(messages), MODEL_NAME, db)
+
+    return summarize()
+
+async def open_insight_stream(conversation_id: str, insight_type: str, db) -> AsyncIterator[str]:
+    messages = await get_chat_messages(conversation_id, db)
+    if not messages:
+        raise ConversationNotFound(conversation_id)
+    digest = messages_digest(messages)
+    kind = f"insight:{insight_type}"
+    cached = await result_cache.get(db, conversation_id, digest, kind, MODEL_NAME)
+    if cached is not None:
+        return _single(cached)
+
+    async def generate():
+        parts = []
+        lines = compact_messages(messages, insight_budget(insight_type))
+        async for chunk in llm_client.stream(insight_prompt(lines, insight_type)):
+            parts.append(chunk)
+            yield chunk
+        await result_cache.set(db, conversation_id, digest, kind, MODEL_NAME, "".join(parts))
+
+    return generate()
+
+async def summarize_conversation_fast(conversation_id: str, db) -> str:
+    """Extractive TextRank summary computed locally, without the LLM."""
+    messages = await get_chat_messages(conversation_id, db)
+    if not messages:
+        raise ConversationNotFound(conversation_id)
+    return await asyncio.to_thread(fast_summary, [msg["message"] for msg in messages])
+
+async def conversation_insights_fast(conversation_id: str, insight_types: list[str], db) -> dict[str, str]:
+    """Keywords and highlights computed locally, without the LLM."""
+    messages = await get_chat_messages(conversation_id, db)
+    if not messages:
+        raise ConversationNotFound(conversation_id)
+    texts = [msg["message"] for msg in messages]
+    requested = list(dict.fromkeys(insight_types))
+    results = await asyncio.gather(*(asyncio.to_thread(fast_insight, texts, kind) for kind in requested))
+    return dict(zip(requested, results))
@@ -0,0 +1,383 @@
+import asyncio
+import json
+import logging
+import os
+import zlib
+from datetime import datetime
+from typing import Optional
+import numpy as np
+from bson import Binary
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from app.extractive import tokenize
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_ENABLED = os.getenv("SIMILARITY_ENABLED", "true").lower() in ("1", "true", "yes")
+SIMILARITY_DIM = int(os.getenv("SIMILARITY_DIM", "256"))
+SIMILARITY_DIR = os.getenv("SIMILARITY_DIR", "similarity_index")
+SIMILARITY_BLOCK_ROWS = int(os.getenv("SIMILARITY_BLOCK_ROWS", "65536"))
+SIMILARITY_FLUSH_SECONDS = float(os.getenv("SIMILARITY_FLUSH_SECONDS", "2"))
+SIMILARITY_MAX_PENDING = int(os.getenv("SIMILARITY_MAX_PENDING", "10000"))
+
+
+def hashed_counts(texts: list[str], dim: int = SIMILARITY_DIM) -> np.ndarray:
+    """Unigram and bigram counts hashed into ``dim`` float32 buckets.
+
+    crc32 rather than hash() so bucket assignment is stable across processes.
+    """
+    buckets = []
+    for text in texts:
+        tokens = tokenize(text)
+        grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        buckets.extend(zlib.crc32(gram.encode()) % dim for gram in grams)
+    return np.bincount(np.asarray(buckets, dtype=np.int64), minlength=dim).astype(np.float32)
+
+
+def idf_weights(document_frequency: np.ndarray, documents: int) -> np.ndarray:
+    return (np.log((1 + documents) / (1 + document_frequency)) + 1.0).astype(np.float32)
+
+
+def weigh(counts: np.ndarray, idf: np.ndarray) -> np.ndarray:
+    """L2-normalized TF-IDF rows from raw bucket counts (1-D or 2-D)."""
+    rows = np.log1p(counts, dtype=np.float32) * idf
+    norms = np.linalg.norm(rows, axis=-1, keepdims=True)
+    return np.divide(rows, norms, out=np.zeros_like(rows), where=norms > 0)
+
+
+def batched_top_k(matrix: np.ndarray, queries: np.ndarray, k: int, block_rows: int = SIMILARITY_BLOCK_ROWS, invalid: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+    """Cosine top-k of each query against the rows of a normalized matrix.
+
+    The matrix is scanned ``block_rows`` at a time, so a memory-mapped
+    matrix is paged in sequentially and the temporary score block stays
+    bounded. Rows flagged in ``invalid`` never match. Returns (scores,
+    indices), each of shape (len(queries), k), best first; missing slots
+    hold -inf and -1.
+    """
+    q = queries.shape[0]
+    best_scores = np.full((q, k), -np.inf, dtype=np.float32)
+    best_index = np.full((q, k), -1, dtype=np.int64)
+    for start in range(0, matrix.shape[0], block_rows):
+        block = np.asarray(matrix[start:start + block_rows])
+        scores = queries @ block.T
+        if invalid is not None:
+            scores[:, invalid[start:start + len(block)]] = -np.inf
+        take = min(k, scores.shape[1])
+        top = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+        merged_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+        merged_index = np.concatenate([best_index, top + start], axis=1)
+        keep = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+        best_index = np.take_along_axis(merged_index, keep, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_index, order, axis=1)
+
+
+class SimilarityIndex:
+    """Conversation vectors for local nearest-neighbour search.
+
+    Raw hashed counts per conversation live in the conversation_vectors
+    collection and are the source of truth. Searches run against a base
+    matrix of TF-IDF rows written by ``rebuild`` (memory-mapped from
+    SIMILARITY_DIR) plus an in-memory delta of conversations updated since.
+    Inserted messages are buffered and folded in by a background flush,
+    so the insert path only appends text to a dict. Each row carries the
+    version of the counts it was built from, so a reloaded base drops the
+    delta rows it already covers.
+    """
+
+    def __init__(self, dim: int = SIMILARITY_DIM, directory: str = SIMILARITY_DIR):
+        self.dim = dim
+        self.directory = directory
+        self.base = np.zeros((0, dim), dtype=np.float32)
+        self.base_ids: list[str] = []
+        self.base_versions = np.zeros(0, dtype=np.int64)
+        self._base_rows: dict[str, int] = {}
+        self._stale = np.zeros(0, dtype=bool)
+        self.idf = np.ones(dim, dtype=np.float32)
+        self._delta: dict[str, np.ndarray] = {}
+        self._delta_versions: dict[str, int] = {}
+        self._delta_snapshot = None
+        self._pending: dict[str, list[str]] = {}
+        self._pending_messages = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._db = None
+        self._loaded_mtime = None
+        self.flushes = 0
+        self.conflicts = 0
+
+    def load(self):
+        paths = [os.path.join(self.directory, name) for name in ("vectors.npy", "ids.json", "idf.npy")]
+        if not all(os.path.exists(path) for path in paths):
+            return
+        self._loaded_mtime = os.path.getmtime(paths[2])
+        base = np.load(paths[0], mmap_mode="r")
+        if base.shape[1] != self.dim:
+            logger.warning("Similarity index has dim %d, expected %d; rebuild it", base.shape[1], self.dim)
+            return
+        with open(paths[1]) as f:
+            self.base_ids = json.load(f)
+        self.base = base
+        self.idf = np.load(paths[2])
+        versions_path = os.path.join(self.directory, "versions.npy")
+        # Indexes written before versions were recorded prune nothing.
+        self.base_versions = np.load(versions_path) if os.path.exists(versions_path) else np.zeros(len(self.base_ids), dtype=np.int64)
+        self._base_rows = {conversation_id: row for row, conversation_id in enumerate(self.base_ids)}
+        self._stale = np.zeros(len(self.base_ids), dtype=bool)
+        for conversation_id in list(self._delta):
+            row = self._base_rows.get(conversation_id)
+            if row is None:
+                continue
+            if self.base_versions[row] >= self._delta_versions[conversation_id]:
+                # The rebuild already includes these counts.
+                del self._delta[conversation_id]
+                del self._delta_versions[conversation_id]
+            else:
+                self._stale[row] = True
+        self._delta_snapshot = None
+
+    def _reload_if_rebuilt(self):
+        try:
+            mtime = os.path.getmtime(os.path.join(self.directory, "idf.npy"))
+        except OSError:
+            return
+        if mtime != self._loaded_mtime:
+            self.load()
+
+    def start(self, db):
+        if not SIMILARITY_ENABLED or self._task is not None:
+            return
+        self._db = db
+        self.load()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self.flush()
+
+    def observe(self, documents: list[dict]):
+        """Queue inserted messages; called by crud after every insert."""
+        if self._task is None:
+            return
+        for doc in documents:
+            self._pending.setdefault(doc["conversation_id"], []).append(doc["message"])
+        self._pending_messages += len(documents)
+        if self._pending_messages >= SIMILARITY_MAX_PENDING:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), SIMILARITY_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._reload_if_rebuilt()
+            try:
+                await self.flush()
+            except PyMongoError as e:
+                logger.warning("Similarity flush failed: %s", e)
+
+    async def flush(self):
+        if not self._pending or self._db is None:
+            return
+        pending, self._pending, self._pending_messages = self._pending, {}, 0
+        increments = await asyncio.to_thread(
+            lambda: {conversation_id: hashed_counts(texts, self.dim) for conversation_id, texts in pending.items()}
+        )
+        for conversation_id, increment in increments.items():
+            stored = await self._add_counts(conversation_id, increment)
+            if stored is None:
+                # Lost a race with another writer; retry on the next flush.
+                self.conflicts += 1
+                self._pending.setdefault(conversation_id, []).extend(pending[conversation_id])
+                self._pending_messages += len(pending[conversation_id])
+                continue
+            counts, version = stored
+            self._set_row(conversation_id, weigh(counts, self.idf), version)
+        self.flushes += 1
+
+    async def _add_counts(self, conversation_id: str, increment: np.ndarray) -> Optional[tuple[np.ndarray, int]]:
+        """Add to the stored counts with an optimistic version check.
+
+        Returns the new counts and version, or None on conflict.
+        """
+        db = self._db
+        doc = await db.conversation_vectors.find_one({"_id": conversation_id})
+        if doc is None or doc.get("dim") != self.dim:
+            counts = increment
+        else:
+            counts = np.frombuffer(doc["counts"], dtype=np.float32) + increment
+        fields = {"counts": Binary(counts.tobytes()), "dim": self.dim, "updated_at": datetime.utcnow()}
+        if doc is None:
+            try:
+                await db.conversation_vectors.insert_one({"_id": conversation_id, "version": 1, **fields})
+            except DuplicateKeyError:
+                return None
+            return counts, 1
+        result = await db.conversation_vectors.update_one(
+            {"_id": conversation_id, "version": doc["version"]}, {"$set": fields, "$inc": {"version": 1}}
+        )
+        return (counts, doc["version"] + 1) if result.modified_count == 1 else None
+
+    def _set_row(self, conversation_id: str, row: Optional[np.ndarray], version: int = 0):
+        base_row = self._base_rows.get(conversation_id)
+        if base_row is not None:
+            self._stale[base_row] = True
+        if row is None:
+            self._delta.pop(conversation_id, None)
+            self._delta_versions.pop(conversation_id, None)
+        else:
+            self._delta[conversation_id] = row
+            self._delta_versions[conversation_id] = version
+        self._delta_snapshot = None
+
+    def remove(self, conversation_id: str):
+        self._pending.pop(conversation_id, None)
+        self._set_row(conversation_id, None)
+
+    def _row(self, conversation_id: str) -> Optional[np.ndarray]:
+        row = self._delta.get(conversation_id)
+        if row is not None:
+            return row
+        base_row = self._base_rows.get(conversation_id)
+        if base_row is not None and not self._stale[base_row]:
+            return np.asarray(self.base[base_row])
+        return None
+
+    def _snapshot(self):
+        if self._delta_snapshot is None:
+            ids = list(self._delta)
+            matrix = np.stack([self._delta[i] for i in ids]) if ids else np.zeros((0, self.dim), dtype=np.float32)
+            self._delta_snapshot = (ids, matrix)
+        return self.base, self.base_ids, self._stale.copy(), self._delta_snapshot
+
+    async def similar(self, conversation_id: str, db, k: int = 10) -> Optional[list[dict]]:
+        """The k most similar other conversations, or None if there is no vector for it."""
+        query = self._row(conversation_id)
+        if query is None:
+            doc = await db.conversation_vectors.find_one({"_id": conversation_id})
+            if doc is None or doc.get("dim") != self.dim:
+                return None
+            query = weigh(np.frombuffer(doc["counts"], dtype=np.float32), self.idf)
+        base, base_ids, stale, (delta_ids, delta) = self._snapshot()
+        if conversation_id in self._base_rows:
+            stale[self._base_rows[conversation_id]] = True
+        return await asyncio.to_thread(self._search, query, k, conversation_id, base, base_ids, stale, delta_ids, delta)
+
+    @staticmethod
+    def _search(query, k, conversation_id, base, base_ids, stale, delta_ids, delta) -> list[dict]:
+        queries = query.reshape(1, -1)
+        # One extra candidate from each side covers the query's own delta row.
+        base_scores, base_index = batched_top_k(base, queries, k, invalid=stale)
+        delta_scores, delta_index = batched_top_k(delta, queries, k + 1)
+        candidates = [(float(s), base_ids[i]) for s, i in zip(base_scores[0], base_index[0]) if i >= 0]
+        candidates += [(float(s), delta_ids[i]) for s, i in zip(delta_scores[0], delta_index[0]) if i >= 0]
+        candidates = [(s, c) for s, c in candidates if c != conversation_id and s > 0]
+        candidates.sort(key=lambda item: -item[0])
+        return [{"conversation_id": c, "score": round(s, 4)} for s, c in candidates[:k]]
+
+    def stats(self):
+        return {
+            "dim": self.dim,
+            "base_rows": len(self.base_ids),
+            "delta_rows": len(self._delta),
+            "pending_messages": self._pending_messages,
+            "flushes": self.flushes,
+            "conflicts": self.conflicts,
+        }
+
+
+async def _recount(db, dim: int, batch_size: int = 1000) -> int:
+    """Recompute every conversation's counts from chat_messages."""
+    written = 0
+    current, texts, ops = None, [], []
+
+    async def emit():
+        nonlocal written
+        counts = hashed_counts(texts, dim)
+        ops.append(UpdateOne(
+            {"_id": current},
+            {"$set": {"counts": Binary(counts.tobytes()), "dim": dim, "updated_at": datetime.utcnow()}, "$inc": {"version": 1}},
+            upsert=True,
+        ))
+        written += 1
+        if len(ops) >= batch_size:
+            await db.conversation_vectors.bulk_write(ops, ordered=False)
+            ops.clear()
+
+    cursor = db.chat_messages.find({}, {"conversation_id": 1, "message": 1}, batch_size=5000).sort(
+        [("conversation_id", 1), ("timestamp", 1), ("_id", 1)]
+    )
+    async for doc in cursor:
+        if doc["conversation_id"] != current:
+            if current is not None:
+                await emit()
+            current, texts = doc["conversation_id"], []
+        texts.append(doc["message"])
+    if current is not None:
+        await emit()
+    if ops:
+        await db.conversation_vectors.bulk_write(ops, ordered=False)
+    return written
+
+
+async def rebuild(db, dim: int = SIMILARITY_DIM, directory: str = SIMILARITY_DIR, recount: bool = False, batch_size: int = 10000) -> int:
+    """Write a fresh base matrix from the stored counts; returns the row count.
+
+    Two passes over conversation_vectors: the first gathers document
+    frequencies for the IDF, the second writes weighted rows straight into
+    a memory-mapped .npy, so memory stays bounded by ``batch_size``. The
+    version of each row's counts goes to versions.npy, so serving nodes can
+    drop delta rows the new matrix already covers.
+    ``recount`` first recomputes counts from chat_messages; it misses
+    messages already moved to cold storage.
+    """
+    if recount:
+        await _recount(db, dim)
+    query = {"dim": dim}
+    document_frequency = np.zeros(dim, dtype=np.int64)
+    ids = []
+    async for doc in db.conversation_vectors.find(query, {"counts": 1}).sort("_id", 1):
+        document_frequency += np.frombuffer(doc["counts"], dtype=np.float32) > 0
+        ids.append(doc["_id"])
+    idf = idf_weights(document_frequency, len(ids))
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, "vectors.tmp.npy")
+    matrix = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(len(ids), dim))
+    versions = np.zeros(len(ids), dtype=np.int64)
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        found = {
+            doc["_id"]: doc
+            async for doc in db.conversation_vectors.find({"_id": {"$in": chunk}, **query}, {"counts": 1, "version": 1})
+        }
+        # Conversations deleted since the first pass keep an all-zero row, which never matches.
+        zeros = np.zeros(dim, dtype=np.float32)
+        counts = np.stack([
+            np.frombuffer(found[cid]["counts"], dtype=np.float32) if cid in found else zeros for cid in chunk
+        ])
+        matrix[start:start + len(chunk)] = weigh(counts, idf)
+        versions[start:start + len(chunk)] = [found[cid].get("version", 0) if cid in found else 0 for cid in chunk]
+    matrix.flush()
+    del matrix
+    with open(os.path.join(directory, "ids.tmp.json"), "w") as f:
+        json.dump(ids, f)
+    np.save(os.path.join(directory, "versions.tmp.npy"), versions)
+    np.save(os.path.join(directory, "idf.tmp.npy"), idf)
+    # idf.npy goes last: serving nodes reload when its mtime changes.
+    for name in ("vectors.npy", "ids.json", "versions.npy", "idf.npy"):
+        stem, ext = name.split(".")
+        os.replace(os.path.join(directory, f"{stem}.tmp.{ext}"), os.path.join(directory, name))
+    return len(ids)
+
+
+similarity_index = SimilarityIndex()
@@ -1,9 +1,12 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
 import json
 from typing import List, Dict
 import os
+import uuid
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -13,6 +16,11 @@ load_dotenv()
 API_URL = os.getenv("API_URL", "http://localhost:8000")
 LOGIN_URL = f"{API_URL}/users/auth/login"
 REGISTER_URL = f"{API_URL}/users/auth/register"
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "3.05"))
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "60"))
+API_RETRIES = int(os.getenv("API_RETRIES", "3"))
+TIMEOUT = (API_CONNECT_TIMEOUT, API_READ_TIMEOUT)
+RESULT_CACHE_ENTRIES = int(os.getenv("RESULT_CACHE_ENTRIES", "256"))
 
 # Page configuration
 st.set_page_config(
@@ -66,6 +74,28 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_http() -> requests.Session:
+    """One pooled session for the whole app, so calls reuse keep-alive connections.
+
+    Only idempotent requests are retried; a retried POST could store a
+    message twice.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=API_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=32)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def auth_headers() -> Dict:
+    return {"Authorization": f"Bearer {st.session_state.jwt_token}"}
+
 def initialize_session_state():
     """Initialize session state variables if they don't exist."""
     if "messages" not in st.session_state:
@@ -82,12 +112,25 @@ def initialize_session_state():
         st.session_state.summary = None
     if "sentiment" not in st.session_state:
         st.session_state.sentiment = None
+    if "history" not in st.session_state:
+        st.session_state.history = []
+    if "history_cursor" not in st.session_state:
+        st.session_state.history_cursor = None
+
+def reset_conversation():
+    st.session_state.conversation_id = None
+    st.session_state.messages = []
+    st.session_state.history = []
+    st.session_state.history_cursor = None
+    st.session_state.summary = None
+    st.session_state.sentiment = None
 
 def login(username: str, password: str) -> bool:
     try:
-        response = requests.post(
+        response = get_http().post(
             LOGIN_URL,
-            json={"username": username, "password": password}
+            json={"username": username, "password": password},
+            timeout=TIMEOUT
         )
         response.raise_for_status()
         data = response.json()
@@ -102,10 +145,12 @@ def login(username: str, password: str) -> bool:
         return False
 
 def register(username: str, password: str) -> bool:
+    response = None
     try:
-        response = requests.post(
+        response = get_http().post(
             REGISTER_URL,
-            json={"username": username, "password": password}
+            json={"username": username, "password": password},
+            timeout=TIMEOUT
         )
         response.raise_for_status()
         st.success("Registration successful! Please log in.")
@@ -123,7 +168,7 @@ def register(username: str, password: str) -> bool:
 def send_message(message: str) -> Dict:
     """Send a message to the API."""
     if not st.session_state.conversation_id:
-        st.session_state.conversation_id = f"conv_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        st.session_state.conversation_id = f"conv_{uuid.uuid4().hex}"
     
     payload = {
         "conversation_id": st.session_state.conversation_id,
@@ -131,10 +176,8 @@ def send_message(message: str) -> Dict:
         "message": message,
         "timestamp": datetime.now().isoformat()
     }
-    headers = {"Authorization": f"Bearer {st.session_state.jwt_token}"}
-    
     try:
-        response = requests.post(f"{API_URL}/chats", json=payload, headers=headers)
+        response = get_http().post(f"{API_URL}/chats/", json=payload, headers=auth_headers(), timeout=TIMEOUT)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -142,33 +185,90 @@ def send_message(message: str) -> Dict:
         return None
 
 def get_conversation_history() -> List[Dict]:
-    """Retrieve conversation history from the API."""
+    """Return the conversation history, fetching only messages newer than the last one seen."""
     if not st.session_state.conversation_id:
         return []
-    
-    headers = {"Authorization": f"Bearer {st.session_state.jwt_token}"}
+    params = {"since": st.session_state.history_cursor} if st.session_state.history_cursor else None
     try:
-        response = requests.get(f"{API_URL}/chats/{st.session_state.conversation_id}", headers=headers)
+        response = get_http().get(
+            f"{API_URL}/chats/{st.session_state.conversation_id}",
+            params=params, headers=auth_headers(), timeout=TIMEOUT
+        )
+        if response.status_code == 404:
+            return st.session_state.history
         response.raise_for_status()
-        return response.json()
+        st.session_state.history.extend(response.json())
+        st.session_state.history_cursor = response.headers.get("X-Next-Cursor", st.session_state.history_cursor)
     except requests.exceptions.RequestException as e:
         st.error(f"Error retrieving conversation: {str(e)}")
-        return []
+    return st.session_state.history
+
+def conversation_version() -> str:
+    """Cursor of the newest message; changes whenever the conversation does."""
+    get_conversation_history()
+    return st.session_state.history_cursor or ""
+
+def stream_result(path: str, payload: Dict, result_field: str, placeholder, title: str, box_class: str) -> str:
+    """Call a server-sent-events endpoint and render the text as it arrives."""
+    headers = {**auth_headers(), "Accept": "text/event-stream"}
+    text = ""
+    event = "message"
+    with get_http().post(f"{API_URL}{path}", json=payload, headers=headers, stream=True, timeout=TIMEOUT) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                event = "message"
+                continue
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+                continue
+            if not line.startswith("data:"):
+                continue
+            data = json.loads(line[len("data:"):].strip())
+            if event == "error":
+                raise requests.exceptions.RequestException(data.get("detail", "stream error"))
+            if event == "done":
+                text = data.get(result_field, text)
+                break
+            text += data.get("delta", "")
+            placeholder.markdown(f"""
+                <div class="{box_class}">
+                    <b>{title}:</b><br>{text}
+                </div>
+            """, unsafe_allow_html=True)
+    return text
+
+# Results are cached per conversation version, so repeated clicks on an
+# unchanged conversation are served locally. A miss streams into a
+# placeholder created inside the function, which keeps it replayable.
+@st.cache_data(max_entries=RESULT_CACHE_ENTRIES, show_spinner=False)
+def cached_summary(conversation_id: str, version: str) -> str:
+    placeholder = st.empty()
+    summary = stream_result(
+        "/chats/summarize/stream",
+        {"conversation_id": conversation_id},
+        "summary", placeholder, "Summary", "summary-box"
+    )
+    placeholder.empty()
+    return summary
+
+@st.cache_data(max_entries=RESULT_CACHE_ENTRIES, show_spinner=False)
+def cached_insight(conversation_id: str, version: str, insight_type: str, title: str) -> str:
+    placeholder = st.empty()
+    insight = stream_result(
+        "/chats/insights/stream",
+        {"conversation_id": conversation_id, "insight_type": insight_type},
+        "insight", placeholder, title, "sentiment-box"
+    )
+    placeholder.empty()
+    return insight
 
 def get_summary() -> str:
-    """Get conversation summary from the API."""
+    """Get the conversation summary, streaming it in on a cache miss."""
     if not st.session_state.conversation_id:
         return "No conversation to summarize"
-    
-    headers = {"Authorization": f"Bearer {st.session_state.jwt_token}"}
     try:
-        response = requests.post(
-            f"{API_URL}/chats/summarize",
-            json={"conversation_id": st.session_state.conversation_id},
-            headers=headers
-        )
-        response.raise_for_status()
-        return response.json().get("summary", "No summary available")
+        return cached_summary(st.session_state.conversation_id, conversation_version()) or "No summary available"
     except requests.exceptions.RequestException as e:
         st.error(f"Error getting summary: {str(e)}")
         return "Error retrieving summary"
@@ -176,15 +276,10 @@ def get_summary() -> str:
 def get_sentiment() -> str:
     if not st.session_state.conversation_id:
         return "No conversation to analyze"
-    headers = {"Authorization": f"Bearer {st.session_state.jwt_token}"}
     try:
-        response = requests.post(
-            f"{API_URL}/chats/insights",
-            json={"conversation_id": st.session_state.conversation_id, "insight_type": "sentiment"},
-            headers=headers
-        )
-        response.raise_for_status()
-        return response.json().get("insight", "No sentiment available")
+        return cached_insight(
+            st.session_state.conversation_id, conversation_version(), "sentiment", "Sentiment"
+        ) or "No sentiment available"
     except requests.exceptions.RequestException as e:
         st.error(f"Error getting sentiment: {str(e)}")
         return "Error retrieving sentiment"
@@ -249,19 +344,13 @@ def main():
         # Conversation controls
         st.subheader("Conversation Controls")
         if st.button("🆕 New Conversation", use_container_width=True):
-            st.session_state.conversation_id = None
-            st.session_state.messages = []
-            st.session_state.summary = None
-            st.session_state.sentiment = None
+            reset_conversation()
             st.rerun()
         
         if st.button("🚪 Logout", use_container_width=True):
             st.session_state.jwt_token = None
             st.session_state.username = ""
-            st.session_state.messages = []
-            st.session_state.conversation_id = None
-            st.session_state.summary = None
-            st.session_state.sentiment = None
+            reset_conversation()
             st.success("Logged out successfully.")
             st.rerun()
     
@@ -304,11 +393,13 @@ def main():
     # Summary and Sentiment Buttons
     col1, col2 = st.columns(2)
     with col1:
-        if st.button("📊 Summarize Conversation", use_container_width=True):
-            st.session_state.summary = get_summary()
+        summarize_clicked = st.button("📊 Summarize Conversation", use_container_width=True)
     with col2:
-        if st.button("😊 Analyze Sentiment", use_container_width=True):
-            st.session_state.sentiment = get_sentiment()
+        sentiment_clicked = st.button("😊 Analyze Sentiment", use_container_width=True)
+    if summarize_clicked:
+        st.session_state.summary = get_summary()
+    if sentiment_clicked:
+        st.session_state.sentiment = get_sentiment()
     
     # Display Results
     if st.session_state.summary:
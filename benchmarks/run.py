@@ -0,0 +1,297 @@
+"""Offline load test for the API.
+
+Runs ``app.main:app`` in-process against mongomock-motor (or a real mongod
+via --mongodb-uri) with the fake LLM backend, drives a weighted mix of
+requests and reports throughput and latency percentiles per endpoint.
+
+    python -m benchmarks.run --duration 30 --concurrency 32
+    python -m benchmarks.run --save-baseline
+    python -m benchmarks.run --compare            # exit 1 on regression
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+RESULTS_DIR = BENCH_DIR / "results"
+HISTORY_FILE = BENCH_DIR / "history.jsonl"
+BASELINE_FILE = BENCH_DIR / "baseline.json"
+
+WORKLOAD = {
+    "ingest": 30,
+    "ingest_bulk": 5,
+    "history": 25,
+    "history_filtered": 10,
+    "user_history": 15,
+    "summarize": 10,
+    "insights": 5,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds to run the mixed workload")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent virtual clients")
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--seed-messages", type=int, default=40, help="messages preloaded per conversation")
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0)
+    parser.add_argument("--mongodb-uri", default=None, help="use a real mongod instead of mongomock")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true", help="compare against the saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--admission", action="store_true", help="keep admission control on (off by default so the harness measures raw capacity)")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    # Must run before the app is imported: these are read at import time.
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["LLM_FAKE_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["LLM_RATE_LIMIT_PER_SEC"] = "0"
+    os.environ["VERIFY_QUERY_PLANS"] = "false"
+    os.environ["ADMISSION_ENABLED"] = "true" if args.admission else "false"
+    os.environ["DATABASE_NAME"] = f"bench_{uuid.uuid4().hex[:8]}"
+    if args.mongodb_uri:
+        os.environ["MONGODB_URI"] = args.mongodb_uri
+
+
+async def install_mongo_standin():
+    import mongomock.collection
+    from mongomock_motor import AsyncMongoMockClient
+    from app import database
+
+    # pymongo >= 4.9 passes a ``sort`` argument that mongomock's bulk builder
+    # does not accept yet; it only matters for replacement ordering.
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+    if "sort" not in add_update.__code__.co_varnames:
+        def add_update_compat(self, *args, sort=None, **kwargs):
+            return add_update(self, *args, **kwargs)
+        mongomock.collection.BulkOperationBuilder.add_update = add_update_compat
+    database.client = AsyncMongoMockClient()
+    database.db = database.client[database.DATABASE_NAME]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {name: [] for name in WORKLOAD}
+        self.errors = {name: 0 for name in WORKLOAD}
+
+    def record(self, name, seconds, ok):
+        self.latencies[name].append(seconds * 1000)
+        if not ok:
+            self.errors[name] += 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for name, values in self.latencies.items():
+            values = sorted(values)
+            endpoints[name] = {
+                "requests": len(values),
+                "errors": self.errors[name],
+                "throughput_rps": len(values) / elapsed if elapsed else 0.0,
+                "mean_ms": statistics.fmean(values) if values else 0.0,
+                "p50_ms": percentile(values, 0.50),
+                "p95_ms": percentile(values, 0.95),
+                "p99_ms": percentile(values, 0.99),
+            }
+        total = sum(e["requests"] for e in endpoints.values())
+        return {"total_requests": total, "throughput_rps": total / elapsed if elapsed else 0.0, "endpoints": endpoints}
+
+
+class Workload:
+    def __init__(self, client, headers, args, rng):
+        self.client = client
+        self.headers = headers
+        self.args = args
+        self.rng = rng
+        self.conversations = [f"bench-conv-{i}" for i in range(args.conversations)]
+        self.users = [f"bench-user-{i}" for i in range(args.users)]
+
+    def _message(self, conversation_id=None):
+        words = ["order", "refund", "shipping", "invoice", "meeting", "deadline", "great", "issue", "update", "thanks"]
+        return {
+            "conversation_id": conversation_id or self.rng.choice(self.conversations),
+            "user_id": self.rng.choice(self.users),
+            "message": " ".join(self.rng.choice(words) for _ in range(self.rng.randint(4, 20))),
+        }
+
+    async def seed(self):
+        for conversation_id in self.conversations:
+            rows = [self._message(conversation_id) for _ in range(self.args.seed_messages)]
+            response = await self.client.post("/chats/bulk", json=rows, headers=self.headers)
+            response.raise_for_status()
+
+    async def ingest(self):
+        return await self.client.post("/chats/", json=self._message(), headers=self.headers)
+
+    async def ingest_bulk(self):
+        rows = [self._message() for _ in range(50)]
+        return await self.client.post("/chats/bulk", json=rows, headers=self.headers)
+
+    async def history(self):
+        return await self.client.get(f"/chats/{self.rng.choice(self.conversations)}", headers=self.headers)
+
+    async def history_filtered(self):
+        start = (datetime.utcnow() - timedelta(minutes=5)).isoformat()
+        return await self.client.get(
+            f"/chats/{self.rng.choice(self.conversations)}", params={"start_date": start}, headers=self.headers
+        )
+
+    async def user_history(self):
+        user_id = self.rng.choice(self.users)
+        response = await self.client.get(f"/users/users/{user_id}/chats", params={"limit": 20})
+        cursor = response.headers.get("X-Next-Cursor")
+        if response.status_code == 200 and cursor:
+            response = await self.client.get(
+                f"/users/users/{user_id}/chats", params={"limit": 20, "cursor": cursor}
+            )
+        return response
+
+    async def summarize(self):
+        return await self.client.post(
+            "/chats/summarize", json={"conversation_id": self.rng.choice(self.conversations)}, headers=self.headers
+        )
+
+    async def insights(self):
+        return await self.client.post(
+            "/chats/insights",
+            json={"conversation_id": self.rng.choice(self.conversations), "insight_types": ["sentiment", "keywords"]},
+            headers=self.headers,
+        )
+
+
+async def authenticate(client):
+    credentials = {"username": f"bench-{uuid.uuid4().hex[:8]}", "password": "bench-password"}
+    (await client.post("/users/auth/register", json=credentials)).raise_for_status()
+    response = await client.post("/users/auth/login", json=credentials)
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def run_benchmark(args):
+    import httpx
+    from app.main import app
+
+    if not args.mongodb_uri:
+        await install_mongo_standin()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            headers = await authenticate(client)
+            workload = Workload(client, headers, args, random.Random(args.seed))
+            await workload.seed()
+
+            recorder = Recorder()
+            names = list(WORKLOAD)
+            weights = [WORKLOAD[name] for name in names]
+            deadline = time.perf_counter() + args.duration
+
+            async def virtual_client(worker_seed):
+                rng = random.Random(worker_seed)
+                while time.perf_counter() < deadline:
+                    name = rng.choices(names, weights)[0]
+                    started = time.perf_counter()
+                    try:
+                        response = await getattr(workload, name)()
+                        ok = response.status_code < 400
+                    except Exception:
+                        ok = False
+                    recorder.record(name, time.perf_counter() - started, ok)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(virtual_client(args.seed + i) for i in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "backend": "mongod" if args.mongodb_uri else "mongomock",
+        "config": {
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+            "conversations": args.conversations,
+            "users": args.users,
+            "seed_messages": args.seed_messages,
+            "llm_latency_ms": args.llm_latency_ms,
+        },
+        "elapsed_s": elapsed,
+        **recorder.summary(elapsed),
+    }
+
+
+def compare(result, baseline, threshold):
+    """List regressions: p95 latency up or throughput down by more than threshold."""
+    regressions = []
+    for name, current in result["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous or not previous["requests"] or not current["requests"]:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {previous['p95_ms']:.1f}ms -> {current['p95_ms']:.1f}ms")
+        if previous["throughput_rps"] and current["throughput_rps"] < previous["throughput_rps"] * (1 - threshold):
+            regressions.append(
+                f"{name}: throughput {previous['throughput_rps']:.1f} -> {current['throughput_rps']:.1f} req/s"
+            )
+    return regressions
+
+
+def print_report(result):
+    print(f"{'endpoint':<18}{'reqs':>8}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, e in result["endpoints"].items():
+        print(
+            f"{name:<18}{e['requests']:>8}{e['errors']:>6}{e['throughput_rps']:>9.1f}"
+            f"{e['p50_ms']:>9.1f}{e['p95_ms']:>9.1f}{e['p99_ms']:>9.1f}"
+        )
+    print(f"total: {result['total_requests']} requests, {result['throughput_rps']:.1f} req/s")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment(args)
+    sys.path.insert(0, str(BENCH_DIR.parent))
+    result = asyncio.run(run_benchmark(args))
+    print_report(result)
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    stamp = result["timestamp"].replace(":", "").replace("-", "").split(".")[0]
+    (RESULTS_DIR / f"{stamp}.json").write_text(json.dumps(result, indent=2))
+    with HISTORY_FILE.open("a") as history:
+        history.write(json.dumps(result) + "\n")
+
+    if args.save_baseline:
+        BASELINE_FILE.write_text(json.dumps(result, indent=2))
+        print(f"Saved baseline to {BASELINE_FILE}")
+    if args.compare:
+        if not BASELINE_FILE.exists():
+            print("No baseline saved; run with --save-baseline first")
+            return 2
+        regressions = compare(result, json.loads(BASELINE_FILE.read_text()), args.threshold)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
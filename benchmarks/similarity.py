@@ -0,0 +1,107 @@
+"""Offline benchmark for similar-conversation search.
+
+Builds a synthetic, memory-mapped index of --conversations vectors in the
+same on-disk layout as ``python -m app.manage rebuild-similarity`` and
+reports vectorization throughput plus single and batched top-k latency.
+
+    python -m benchmarks.similarity                      # 1M conversations, dim 256
+    python -m benchmarks.similarity --conversations 200000 --batch 64
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from app.similarity import SIMILARITY_BLOCK_ROWS, SIMILARITY_DIM, batched_top_k, hashed_counts, idf_weights, weigh
+
+WORDS = (
+    "order refund shipping delivery package tracking account password login reset email invoice payment card "
+    "charge subscription cancel upgrade plan price discount coupon broken damaged missing late address phone "
+    "support agent help thanks please issue problem error app website update"
+).split()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.similarity")
+    parser.add_argument("--conversations", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=SIMILARITY_DIM)
+    parser.add_argument("--block-rows", type=int, default=SIMILARITY_BLOCK_ROWS)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=50, help="single-query searches to time")
+    parser.add_argument("--batch", type=int, default=32, help="queries per batched search")
+    parser.add_argument("--texts", type=int, default=20000, help="messages to vectorize for the throughput figure")
+    parser.add_argument("--dir", default=None, help="where to write the index (default: a temporary directory)")
+    parser.add_argument("--seed", type=int, default=1234)
+    return parser.parse_args(argv)
+
+
+def synthetic_texts(rng, n: int) -> list:
+    return [" ".join(rng.choice(WORDS, size=rng.integers(8, 40))) for _ in range(n)]
+
+
+def build_matrix(path: str, rows: int, dim: int, rng, chunk: int = 65536) -> np.memmap:
+    """Write ``rows`` normalized vectors with a sparse, skewed term distribution."""
+    matrix = open_memmap(path, mode="w+", dtype=np.float32, shape=(rows, dim))
+    idf = idf_weights(rng.integers(1, rows, size=dim).astype(np.float32), rows)
+    for start in range(0, rows, chunk):
+        n = min(chunk, rows - start)
+        counts = rng.poisson(0.3, size=(n, dim)).astype(np.float32)
+        counts[counts.sum(axis=1) == 0, 0] = 1
+        matrix[start:start + n] = weigh(counts, idf)
+    matrix.flush()
+    return matrix
+
+
+def percentile(values, pct: float) -> float:
+    return float(np.percentile(values, pct)) if values else 0.0
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    rng = np.random.default_rng(args.seed)
+
+    texts = synthetic_texts(rng, args.texts)
+    started = time.perf_counter()
+    hashed_counts(texts, args.dim)
+    vectorize_seconds = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.dir or tmp
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "vectors.npy")
+        started = time.perf_counter()
+        build_matrix(path, args.conversations, args.dim, rng)
+        build_seconds = time.perf_counter() - started
+        matrix = np.load(path, mmap_mode="r")
+
+        rows = rng.integers(0, args.conversations, size=max(args.queries, args.batch))
+        # The first scan pages the file in; time warm scans, as a serving node would see.
+        batched_top_k(matrix, np.asarray(matrix[rows[:1]]), args.k, args.block_rows)
+        single = []
+        for row in rows[:args.queries]:
+            started = time.perf_counter()
+            batched_top_k(matrix, np.asarray(matrix[[row]]), args.k, args.block_rows)
+            single.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        batched_top_k(matrix, np.asarray(matrix[rows[:args.batch]]), args.k, args.block_rows)
+        batch_ms = (time.perf_counter() - started) * 1000
+
+    size_mb = args.conversations * args.dim * 4 / 2**20
+    print(f"conversations={args.conversations} dim={args.dim} matrix={size_mb:.0f} MiB block_rows={args.block_rows}")
+    print(f"vectorize: {args.texts / vectorize_seconds:,.0f} messages/s")
+    print(f"build:     {build_seconds:.1f}s")
+    print(
+        f"single:    p50={statistics.median(single):.1f}ms p95={percentile(single, 95):.1f}ms "
+        f"({args.queries} queries, k={args.k})"
+    )
+    print(f"batched:   {batch_ms:.1f}ms for {args.batch} queries ({batch_ms / args.batch:.1f}ms/query)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())